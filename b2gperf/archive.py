@@ -0,0 +1,182 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+from optparse import OptionParser
+import os
+import sqlite3
+import time
+
+import numpy
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    gaia_revision TEXT,
+    gecko_revision TEXT,
+    device TEXT,
+    timestamp REAL NOT NULL,
+    ancillary_data TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    metric TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_app ON runs (app, timestamp);
+CREATE INDEX IF NOT EXISTS runs_gaia_revision ON runs (gaia_revision);
+CREATE INDEX IF NOT EXISTS runs_gecko_revision ON runs (gecko_revision);
+CREATE INDEX IF NOT EXISTS runs_device ON runs (device);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS samples_metric ON samples (metric, run_id);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id, metric);
+"""
+
+# Columns of the runs table that summaries can be grouped by
+GROUP_BY = ('gaia_revision', 'gecko_revision', 'device')
+
+
+class ResultsArchive(object):
+    """Local SQLite store of the raw samples and ancillary data of every run,
+    indexed for trend analysis without DataZilla."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_run(self, app_name, results, ancillary_data, device=None,
+                timestamp=None):
+        """Stores the samples of a run, given as lists keyed by metric, and
+        returns the id of the run."""
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (app, gaia_revision, gecko_revision, '
+                'device, timestamp, ancillary_data) VALUES (?, ?, ?, ?, ?, ?)',
+                (app_name,
+                 ancillary_data.get('gaia_revision'),
+                 ancillary_data.get('gecko_revision'),
+                 device,
+                 timestamp or time.time(),
+                 json.dumps(ancillary_data, sort_keys=True)))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO samples (run_id, metric, iteration, value) '
+                'VALUES (?, ?, ?, ?)',
+                ((run_id, metric, iteration, value)
+                 for metric, values in results.iteritems()
+                 for iteration, value in enumerate(values)))
+        return run_id
+
+    def summaries(self, app_name, metric=None, group_by='gaia_revision',
+                  since=None, device=None):
+        """Yields a dict summarising the samples for each value of the
+        group_by column, ordered by the time of its latest run."""
+        if group_by not in GROUP_BY:
+            raise ValueError('Cannot group by %s' % group_by)
+        conditions = ['runs.app = ?']
+        parameters = [app_name]
+        if metric:
+            conditions.append('samples.metric = ?')
+            parameters.append(metric)
+        if since:
+            conditions.append('runs.timestamp >= ?')
+            parameters.append(since)
+        if device:
+            conditions.append('runs.device = ?')
+            parameters.append(device)
+        # Concatenating in SQLite is much faster than fetching each sample
+        rows = self.connection.execute(
+            'SELECT runs.%(group)s, samples.metric, COUNT(DISTINCT runs.id), '
+            'MAX(runs.timestamp), GROUP_CONCAT(samples.value) FROM runs '
+            'JOIN samples ON samples.run_id = runs.id WHERE %(conditions)s '
+            'GROUP BY runs.%(group)s, samples.metric' % {
+                'group': group_by,
+                'conditions': ' AND '.join(conditions)},
+            parameters)
+
+        summaries = []
+        for group, metric, runs, latest, values in rows:
+            values = numpy.fromstring(values, sep=',')
+            summaries.append({
+                group_by: group,
+                'metric': metric,
+                'runs': runs,
+                'count': len(values),
+                'latest': latest,
+                'median': numpy.median(values),
+                'p90': numpy.percentile(values, 90),
+                'mean': values.mean(),
+                'std': values.std(),
+                'min': values.min(),
+                'max': values.max()})
+        for summary in sorted(summaries, key=lambda s: (s['latest'],
+                                                        s['metric'])):
+            yield summary
+
+
+def cli():
+    parser = OptionParser(usage='%prog [options] archive app_name')
+    parser.add_option('--metric',
+                      action='store',
+                      dest='metric',
+                      metavar='str',
+                      help='only summarise this metric')
+    parser.add_option('--group-by',
+                      action='store',
+                      type='choice',
+                      choices=GROUP_BY,
+                      dest='group_by',
+                      default='gaia_revision',
+                      metavar='str',
+                      help='column to summarise results by, one of %s '
+                           '(default: %%default)' % ', '.join(GROUP_BY))
+    parser.add_option('--days',
+                      action='store',
+                      type='float',
+                      dest='days',
+                      metavar='float',
+                      help='only include runs from this many days ago')
+    parser.add_option('--device',
+                      action='store',
+                      dest='device',
+                      metavar='str',
+                      help='only include runs on this device')
+    options, args = parser.parse_args()
+
+    if len(args) != 2:
+        parser.print_usage()
+        parser.exit()
+
+    path, app_name = args
+    if not os.path.exists(path):
+        parser.error('Archive %s does not exist' % path)
+
+    since = options.days and time.time() - options.days * 86400
+    archive = ResultsArchive(path)
+    try:
+        for summary in archive.summaries(app_name, options.metric,
+                                         options.group_by, since,
+                                         options.device):
+            print '%s %s %s: runs:%d, median:%d, p90:%d, mean:%d, std:%d, ' \
+                'max:%s, min:%s' % (
+                    time.strftime('%Y-%m-%d %H:%M',
+                                  time.localtime(summary['latest'])),
+                    summary[options.group_by], summary['metric'],
+                    summary['runs'], summary['median'], summary['p90'],
+                    summary['mean'], summary['std'], summary['max'],
+                    summary['min'])
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    cli()
@@ -4,9 +4,13 @@
 # 1) Install a B2G build with Marionette enabled
 # 2) adb forward tcp:2828 tcp:2828
 
+import json
+import multiprocessing
 from optparse import OptionParser
 import os
 import pkg_resources
+import Queue
+import random
 import time
 import traceback
 from urlparse import urlparse
@@ -23,8 +27,40 @@ import mozlog
 import mozversion
 import numpy
 
+from archive import ResultsArchive
+from compare import compare
+from compare import load_results
+from compare import save_results
+from fixtures import ContentManifest
+from fixtures import DATABASE_PATHS
+from fixtures import FixtureCache
+from fixtures import fixture_key
+from fixtures import STORAGE_PATHS
+from listapps import get_app_index
+from media import MediaPopulator
+from memory import MemorySampler
+from metadata import get_build_id
+from metadata import get_gaia_id
+from metadata import MetadataCache
+from metadata import SETTINGS_FIELDS
+from metadata import VERSION_FIELDS
+from session import CONNECTION_ERRORS
+from session import MarionetteSession
+from settle import QuiescenceMonitor
+from spool import credential_ref
+from spool import DatazillaSpool
+from stats import frame_statistics
+from stats import RunningStats
+from tracing import Tracer
 from version import __version__
 
+# Content populated with b2gpopulate while B2G is stopped
+DATABASE_FIXTURES = ('contacts', 'messages')
+# Content pushed to device storage once B2G has started
+FILE_FIXTURES = ('pictures', 'music', 'videos')
+# Exit code when the results have regressed compared to a baseline
+REGRESSION_EXIT_CODE = 2
+
 
 class B2GPerfError(Exception):
     def __init__(self, message):
@@ -42,6 +78,11 @@ class ExceededThresholdError(B2GPerfError):
             self, 'Exceeded failure threshold for gathering results')
 
 
+class ScrollError(B2GPerfError):
+    def __init__(self):
+        Exception.__init__(self, 'Unable to find content to scroll')
+
+
 class NetworkConnectionError(B2GPerfError):
     def __init__(self):
         Exception.__init__(self, 'Unable to connect to network')
@@ -57,31 +98,32 @@ class MissingMetricError(B2GPerfError):
 class DatazillaPerfPoster(object):
 
     def __init__(self, marionette, datazilla_config=None, sources=None,
-                 log_level='INFO', device_serial=None):
+                 log_level='INFO', device_serial=None, metadata_cache=None,
+                 metadata=None):
         # Set up logging
-        handler = mozlog.StreamHandler()
-        handler.setFormatter(mozlog.MozFormatter(include_timestamp=True))
-        self.logger = mozlog.getLogger(self.__class__.__name__, handler)
-        self.logger.setLevel(getattr(mozlog, log_level.upper()))
+        self.log_level = log_level
+        self.logger = get_logger(self.__class__.__name__, log_level)
 
         self.device_serial = device_serial
-        self.marionette = marionette
-
-        settings = gaiatest.GaiaData(self.marionette).all_settings
-        mac_address = self.marionette.execute_script(
-            'return navigator.mozWifiManager && '
-            'navigator.mozWifiManager.macAddress;')
+        # Session state survives B2G restarts and reconnections
+        self.marionette = marionette and MarionetteSession(marionette,
+                                                           self.logger)
+        self.tracer = Tracer(enabled=False)
 
         self.submit_report = True
         self.ancillary_data = {
             'generated_by': 'b2gperf %s' % __version__,
             'build_url': datazilla_config['build_url']}
 
-        dm = mozdevice.DeviceManagerADB(deviceSerial=self.device_serial)
-        self.device = gaiatest.GaiaDevice(self.marionette, manager=dm)
-
-        version = mozversion.get_version(sources=sources, dm_type='adb',
-                                         device_serial=self.device_serial)
+        # Metadata gathered elsewhere means no device is needed
+        self.device = None
+        if metadata is None:
+            dm = mozdevice.DeviceManagerADB(deviceSerial=self.device_serial)
+            self.device = gaiatest.GaiaDevice(self.marionette, manager=dm)
+            metadata = self.device_metadata(dm, sources, metadata_cache)
+        version = metadata['version']
+        settings = metadata['settings']
+        mac_address = metadata['mac_address']
         self.ancillary_data['build_revision'] = version.get('build_changeset')
         self.ancillary_data['gaia_revision'] = version.get('gaia_changeset')
         self.ancillary_data['gecko_repository'] = version.get('application_repository')
@@ -124,38 +166,100 @@ class DatazillaPerfPoster(object):
         if not self.submit_report:
             self.logger.info('Reports will not be submitted to DataZilla')
 
-    def post_to_datazilla(self, results, app_name):
+        self.spool = None
+        if datazilla_config.get('spool'):
+            # Starting the spool also uploads anything left from earlier runs
+            credentials = {credential_ref(self.required.get('host'),
+                                          self.required.get('project')):
+                           (self.required.get('oauth_key'),
+                            self.required.get('oauth_secret'))}
+            self.spool = DatazillaSpool(datazilla_config['spool'],
+                                        self.logger, credentials)
+            self.spool.start()
+
+    def device_metadata(self, dm, sources, metadata_cache=None):
+        cache = None
+        if metadata_cache:
+            cache = MetadataCache(metadata_cache, self.logger)
+            build_id = get_build_id(dm)
+            # Gaia can be flashed without changing the build ID
+            gaia_id = get_gaia_id(dm)
+            if not gaia_id:
+                self.logger.debug('Unable to identify gaia, metadata will '
+                                  'not be cached')
+            metadata = build_id and gaia_id and cache.get(
+                self.device_serial, build_id, sources, gaia_id)
+            if metadata:
+                self.logger.debug('Using cached metadata for build %s' %
+                                  build_id)
+                return metadata
+
+        settings = gaiatest.GaiaData(self.marionette).all_settings
+        mac_address = self.marionette.execute_script(
+            'return navigator.mozWifiManager && '
+            'navigator.mozWifiManager.macAddress;')
+        version = mozversion.get_version(sources=sources, dm_type='adb',
+                                         device_serial=self.device_serial)
+        metadata = {
+            'version': dict((key, version.get(key)) for key in VERSION_FIELDS),
+            'settings': dict((key, settings.get(key))
+                             for key in SETTINGS_FIELDS),
+            'mac_address': mac_address}
+
+        if cache and build_id and gaia_id:
+            cache.put(self.device_serial, build_id, metadata, sources,
+                      gaia_id)
+        return metadata
+
+    def close(self):
+        if self.spool:
+            self.logger.debug('Waiting for spooled DataZilla submissions')
+            self.spool.close()
+
+    def post_to_datazilla(self, results, app_name, ancillary_data=None):
         # Prepare DataZilla results
-        res = dzclient.DatazillaResult()
         test_suite = app_name.replace(' ', '_').lower()
-        res.add_testsuite(test_suite)
-        for metric in results.keys():
-            res.add_test_results(test_suite, metric, results[metric])
-        req = dzclient.DatazillaRequest(
-            protocol=self.required.get('protocol'),
-            host=self.required.get('host'),
-            project=self.required.get('project'),
-            oauth_key=self.required.get('oauth_key'),
-            oauth_secret=self.required.get('oauth_secret'),
-            machine_name=self.required.get('machine_name'),
-            os='Firefox OS',
-            os_version=self.required.get('os_version'),
-            platform='Gonk',
-            build_name='B2G',
-            version='prerelease',
-            revision=self.ancillary_data.get('gaia_revision'),
-            branch=self.required.get('branch'),
-            id=self.required.get('id'))
-
-        # Send DataZilla results
-        req.add_datazilla_result(res)
-        for dataset in req.datasets():
-            dataset['test_build'].update(self.ancillary_data)
-            dataset['test_machine'].update(
-                {'type': self.required.get('device_name')})
-            self.logger.info('Submitting results to DataZilla: %s' % dataset)
-            response = req.send(dataset)
-            self.logger.info('Response: %s' % response.read())
+        request = {
+            'protocol': self.required.get('protocol'),
+            'host': self.required.get('host'),
+            'project': self.required.get('project'),
+            'oauth_key': self.required.get('oauth_key'),
+            'oauth_secret': self.required.get('oauth_secret'),
+            'machine_name': self.required.get('machine_name'),
+            'os': 'Firefox OS',
+            'os_version': self.required.get('os_version'),
+            'platform': 'Gonk',
+            'build_name': 'B2G',
+            'version': 'prerelease',
+            'revision': self.ancillary_data.get('gaia_revision'),
+            'branch': self.required.get('branch'),
+            'id': self.required.get('id')}
+        test_build = dict(self.ancillary_data)
+        if ancillary_data:
+            test_build.update(ancillary_data)
+        test_machine = {'type': self.required.get('device_name')}
+
+        with self.tracer.span('upload', suite=test_suite):
+            if self.spool:
+                self.spool.put(request, test_suite, results, test_build,
+                               test_machine)
+                return
+
+            res = dzclient.DatazillaResult()
+            res.add_testsuite(test_suite)
+            for metric in results.keys():
+                res.add_test_results(test_suite, metric, results[metric])
+            req = dzclient.DatazillaRequest(**request)
+
+            # Send DataZilla results
+            req.add_datazilla_result(res)
+            for dataset in req.datasets():
+                dataset['test_build'].update(test_build)
+                dataset['test_machine'].update(test_machine)
+                self.logger.info('Submitting results to DataZilla: %s' %
+                                 dataset)
+                response = req.send(dataset)
+                self.logger.info('Response: %s' % response.read())
 
 
 class B2GPerfRunner(DatazillaPerfPoster):
@@ -168,63 +272,550 @@ class B2GPerfRunner(DatazillaPerfPoster):
         self.testvars = kwargs.pop('testvars', {})
         self.reset = kwargs.pop('reset')
         self.start_timeout = kwargs.pop('start_timeout')
+        self.devices = kwargs.pop('devices', None)
+        self.keep_samples = kwargs.pop('keep_samples', False)
+        self.target_precision = kwargs.pop('target_precision', None)
+        self.min_iterations = kwargs.pop('min_iterations', 10)
+        self.fixture_cache = kwargs.pop('fixture_cache', None)
+        self.trace = kwargs.pop('trace', None)
+        self.settle_window = kwargs.pop('settle_window', None)
+        self.launch_mode = kwargs.pop('launch_mode', None)
+        self.milestones = kwargs.pop('milestones', False)
+        self.sample_memory = kwargs.pop('sample_memory', False)
+        self.fused_launch = kwargs.pop('fused_launch', False)
+        self.shared_setup = kwargs.pop('shared_setup', False)
+        self.bulk_media = kwargs.pop('bulk_media', False)
+        self.test_type = kwargs.pop('test_type', 'launch')
+        self.app_order = kwargs.pop('app_order', 'interleaved')
+        archive = kwargs.pop('archive', None)
+        self.baseline = kwargs.pop('baseline', None)
+        self.save_results = kwargs.pop('save_results', None)
+        self.verdict = kwargs.pop('verdict', None)
+        self.regression_threshold = kwargs.pop('regression_threshold', 0)
+        self.results = {}
 
         DatazillaPerfPoster.__init__(self, *args, **kwargs)
+        self.tracer = Tracer(enabled=bool(self.trace))
+        self.archive = archive and ResultsArchive(archive)
         # Add various attributes to the report
         self.ancillary_data['delay'] = self.delay
         self.ancillary_data['restart'] = self.restart
         self.ancillary_data['settle_time'] = self.settle_time
+        if self.settle_window:
+            self.ancillary_data['settle_window'] = self.settle_window
+        self.ancillary_data['test_type'] = self.test_type
+        if self.launch_mode and self.test_type == 'launch':
+            self.ancillary_data['launch_mode'] = self.launch_mode
+        if self.shared_setup:
+            self.ancillary_data['app_order'] = self.app_order
+        if self.target_precision:
+            self.ancillary_data['target_precision'] = self.target_precision
+
+    def test_options(self):
+        return {'iterations': self.iterations,
+                'delay': self.delay,
+                'restart': self.restart,
+                'settle_time': self.settle_time,
+                'testvars': self.testvars,
+                'reset': self.reset,
+                'start_timeout': self.start_timeout,
+                # DataZilla, the archive and comparisons need every sample
+                'keep_samples': self.keep_samples or self.submit_report or
+                bool(self.archive or self.baseline or self.save_results),
+                'target_precision': self.target_precision,
+                'min_iterations': self.min_iterations,
+                'fixture_cache': self.fixture_cache,
+                'settle_window': self.settle_window,
+                'launch_mode': self.launch_mode,
+                'milestones': self.milestones,
+                'sample_memory': self.sample_memory,
+                'fused_launch': self.fused_launch,
+                'bulk_media': self.bulk_media,
+                'test_type': self.test_type}
+
+    def close(self):
+        with self.tracer.span('upload drain'):
+            DatazillaPerfPoster.close(self)
+        if self.archive:
+            self.archive.close()
+        if self.trace:
+            self.tracer.write(self.trace)
+            self.logger.info('Wrote trace to %s' % self.trace)
+            for name, count, total in self.tracer.breakdown():
+                self.logger.info('Phase %s: %.2fs total, %d calls, %.3fs '
+                                 'average' % (name, total, count,
+                                              total / count))
+
+    def create_test(self, app_name):
+        options = self.test_options()
+        test_class = get_test_class(app_name, options.pop('test_type'))
+        return test_class(self.marionette, app_name, self.logger,
+                          device=self.device,
+                          device_serial=self.device_serial,
+                          tracer=self.tracer,
+                          **options)
 
     def measure_app_perf(self, app_names):
+        if self.devices:
+            return self.measure_app_perf_parallel(app_names)
+        if self.shared_setup:
+            return self.measure_app_perf_shared(app_names)
+
         caught_exception = False
         self.marionette.set_script_timeout(60000)
         self.marionette.set_search_timeout(60000)
 
         for app_name in app_names:
-            tests = {
-                'contacts': B2GPerfLaunchContactsTest,
-                'gallery': B2GPerfLaunchGalleryTest,
-                'messages': B2GPerfLaunchMessagesTest,
-                'music': B2GPerfLaunchMusicTest,
-                'video': B2GPerfLaunchVideoTest}
-            if app_name.lower() in tests.keys():
-                test_class = tests[app_name.lower()]
-            else:
-                test_class = B2GPerfLaunchTest
-
-            test = test_class(self.marionette, app_name, self.logger,
-                              self.iterations, self.delay, self.device,
-                              self.restart, self.settle_time, self.testvars,
-                              self.reset, self.start_timeout,
-                              self.device_serial)
+            test = self.create_test(app_name)
             try:
-                test.run()
+                with self.tracer.span('app', app_name=app_name):
+                    test.run()
+                self.report(app_name, test.stats, test.ancillary_data,
+                            test.memory)
+            except (B2GPerfError, B2GPopulateError, MarionetteException):
+                caught_exception = True
+                traceback.print_exc()
+        self.finish(caught_exception)
 
-                if self.submit_report:
-                    self.logger.debug('Submitting report')
-                    self.post_to_datazilla(test.results, app_name)
-                for key, values in test.results.iteritems():
-                    result_summary = 'median:%s, mean:%s, std: %s, max:%s, ' \
-                        'min:%s, all:%s' % (int(numpy.median(values)),
-                                            int(numpy.mean(values)),
-                                            int(numpy.std(values)),
-                                            max(values),
-                                            min(values),
-                                            ','.join(str(x) for x in values))
-                    self.logger.info('Results for %s, %s: %s' % (
-                        app_name, key, result_summary))
+    def measure_app_perf_shared(self, app_names):
+        """Set up the device once with the content every app needs, and
+        then take turns measuring each app until they have all finished."""
+        caught_exception = False
+        self.marionette.set_script_timeout(60000)
+        self.marionette.set_search_timeout(60000)
+
+        tests = [self.create_test(app_name) for app_name in app_names]
+        fixtures = {}
+        for test in tests:
+            for kind, count in test.fixtures.iteritems():
+                fixtures[kind] = max(count, fixtures.get(kind, 0))
+        shared = B2GPerfTest(self.marionette, 'shared', self.logger,
+                             iterations=0,
+                             delay=self.delay,
+                             device=self.device,
+                             restart=self.restart,
+                             settle_time=self.settle_time,
+                             testvars=self.testvars,
+                             reset=self.reset,
+                             start_timeout=self.start_timeout,
+                             device_serial=self.device_serial,
+                             fixture_cache=self.fixture_cache,
+                             tracer=self.tracer,
+                             settle_window=self.settle_window,
+                             bulk_media=self.bulk_media)
+        shared.fixtures = fixtures
+        try:
+            with self.tracer.span('setup', apps=app_names):
+                shared.setup()
+        except (B2GPerfError, B2GPopulateError, MarionetteException):
+            traceback.print_exc()
+            return self.finish(True)
+
+        active = []
+        for test in tests:
+            try:
+                test.start(setup=False)
+                test.ancillary_data.update(shared.ancillary_data)
+                active.append(test)
             except (B2GPerfError, B2GPopulateError, MarionetteException):
                 caught_exception = True
                 traceback.print_exc()
+
+        try:
+            while active:
+                order = list(active)
+                if self.app_order == 'shuffled':
+                    # Spread any drift in the device across the apps
+                    random.shuffle(order)
+                for test in order:
+                    try:
+                        test.step()
+                        while self.app_order == 'sequential' and \
+                                not test.finished(test.success_counter):
+                            test.step()
+                        if test.finished(test.success_counter):
+                            active.remove(test)
+                            test.finish()
+                            self.report(test.app_name, test.stats,
+                                        test.ancillary_data, test.memory)
+                    except (B2GPerfError, B2GPopulateError,
+                            MarionetteException):
+                        caught_exception = True
+                        traceback.print_exc()
+                        active.remove(test)
+                        self.teardown(test)
+        finally:
+            # Leave the shared device clean even if a run is interrupted
+            for test in active:
+                self.teardown(test)
+        self.finish(caught_exception)
+
+    def teardown(self, test):
+        try:
+            test.teardown()
+        except (B2GPerfError,) + CONNECTION_ERRORS:
+            traceback.print_exc()
+
+    def measure_app_perf_parallel(self, app_names):
+        caught_exception = False
+        # Each worker opens its own session, so release ours first
+        self.marionette.delete_session()
+
+        pool = B2GPerfDevicePool(self.devices, self.logger, self.log_level,
+                                 self.test_options(), self.tracer)
+        for app_name, merged in pool.measure(app_names):
+            if merged['errors']:
+                caught_exception = True
+                for serial, error in merged['errors']:
+                    self.logger.error('Failure on %s for %s:\n%s' % (
+                        serial, app_name, error))
+            results = merged['results']
+            if not results:
+                continue
+            sample_devices = merged['sample_devices']
+            stats = dict((key, RunningStats.from_samples(values))
+                         for key, values in results.iteritems())
+            memory = dict((metric, dict(
+                (key, RunningStats.from_samples(values))
+                for key, values in memory_results.iteritems()))
+                for metric, memory_results in merged['memory'].iteritems())
+            self.report(app_name, stats, ancillary_data={
+                'devices': ','.join(sorted(merged['ancillary_data']))},
+                memory=memory, device_data={
+                    'sample_devices': sample_devices,
+                    'devices': merged['ancillary_data']})
+            for key, values in results.iteritems():
+                per_device = {}
+                for value, serial in zip(values, sample_devices[key]):
+                    per_device.setdefault(serial, []).append(value)
+                for serial, device_values in sorted(per_device.items()):
+                    self.logger.info(
+                        'Results for %s, %s on %s: median:%s, count:%d' % (
+                            app_name, key, serial,
+                            int(numpy.median(device_values)),
+                            len(device_values)))
+        self.finish(caught_exception)
+
+    def finish(self, caught_exception):
+        regressed = self.compare_results()
         if caught_exception:
             sys.exit(1)
+        if regressed:
+            sys.exit(REGRESSION_EXIT_CODE)
+
+    def compare_results(self):
+        """Saves the results and compares them with the baseline. Returns
+        True if any metric has regressed."""
+        if self.save_results:
+            save_results(self.save_results, self.results)
+            self.logger.info('Saved results to %s' % self.save_results)
+        if not self.baseline:
+            return False
+
+        verdicts = compare(self.results, load_results(self.baseline),
+                           threshold=self.regression_threshold)
+        for verdict in verdicts:
+            self.logger.info(
+                'Comparison for %s, %s: %s, median:%s (baseline %s), '
+                'change:%s, interval:%s, p:%.4f' % (
+                    verdict['app'], verdict['metric'], verdict['verdict'],
+                    int(verdict['current_median']),
+                    int(verdict['baseline_median']),
+                    verdict['change'] is not None and
+                    '%+.1f%%' % (verdict['change'] * 100),
+                    verdict['interval'] and '%+.1f%%..%+.1f%%' % tuple(
+                        value * 100 for value in verdict['interval']),
+                    verdict['p_value']))
+        if self.verdict:
+            with open(self.verdict, 'w') as f:
+                json.dump(verdicts, f, indent=2, sort_keys=True)
+        regressions = [verdict for verdict in verdicts
+                       if verdict['verdict'] == 'regressed']
+        if regressions:
+            self.logger.error('%d of %d metrics regressed' % (
+                len(regressions), len(verdicts)))
+        return bool(regressions)
+
+    def report(self, app_name, stats, ancillary_data=None, memory=None,
+               device_data=None):
+        """Records, archives and submits the results of an app. The
+        device_data of a parallel run, such as the device each sample was
+        taken on, is only archived, as DataZilla's test_build holds flat
+        fields."""
+        memory = memory or {}
+        samples = dict((key, value.samples) for key, value in stats.iteritems()
+                       if value.samples is not None)
+        # Memory is kept with the suite name as the metric
+        for metric, memory_stats in memory.iteritems():
+            for value in memory_stats.itervalues():
+                if value.samples is not None:
+                    samples[metric] = value.samples
+        self.results[app_name] = samples
+        if self.archive:
+            run_data = dict(ancillary_data or {})
+            run_data.update(device_data or {})
+            self.archive_results(app_name, samples, run_data)
+        if self.submit_report:
+            self.logger.debug('Submitting report')
+            results = dict((key, value.samples)
+                           for key, value in stats.iteritems())
+            self.post_to_datazilla(results, app_name, ancillary_data)
+            # Memory is reported in the same shape as gaiaperf
+            for metric, memory_stats in memory.iteritems():
+                self.post_to_datazilla(
+                    dict((key, value.samples)
+                         for key, value in memory_stats.iteritems()),
+                    metric, ancillary_data)
+        for metric, memory_stats in memory.iteritems():
+            for key, value in memory_stats.iteritems():
+                self.logger.info(
+                    'Memory for %s, %s: median:%.1f, max:%.1f, min:%.1f' % (
+                        key, metric, value.median, value.max, value.min))
+        for key, value in stats.iteritems():
+            result_summary = 'median:%s, p90:%s, mean:%s, std: %s, max:%s, ' \
+                'min:%s' % (int(value.median),
+                            int(value.p90),
+                            int(value.mean),
+                            int(value.std),
+                            value.max,
+                            value.min)
+            if value.samples is not None:
+                result_summary += ', all:%s' % ','.join(
+                    str(x) for x in value.samples)
+            self.logger.info('Results for %s, %s: %s' % (
+                app_name, key, result_summary))
+
+    def archive_results(self, app_name, results, ancillary_data):
+        run_data = dict(self.ancillary_data)
+        run_data.update(ancillary_data or {})
+        if self.devices:
+            device = ','.join(serial for serial, port in self.devices)
+        else:
+            device = self.device_serial or self.required.get('machine_name')
+        run_id = self.archive.add_run(app_name, results, run_data, device)
+        self.logger.debug('Archived results for %s as run %d' % (
+            app_name, run_id))
+
+
+class B2GPerfDevicePool(object):
+    """Spreads the iterations of each app across a pool of devices.
+
+    Every device gets its own worker process and Marionette session. The
+    iterations for an app are split into one chunk per device and queued,
+    so idle workers pick up the next chunk as soon as they are free.
+    """
+
+    # Seconds between checks that the workers are still running
+    poll_interval = 5
+
+    def __init__(self, devices, logger, log_level, test_options,
+                 tracer=None):
+        self.devices = devices
+        self.logger = logger
+        self.log_level = log_level
+        self.test_options = test_options
+        self.tracer = tracer or Tracer(enabled=False)
+
+    def chunks(self, iterations):
+        count = min(len(self.devices), iterations)
+        return [iterations / count + (1 if i < iterations % count else 0)
+                for i in range(count)]
+
+    def measure(self, app_names):
+        """Run all apps across the pool.
+
+        Yields the app name and a dict of merged results, the serial of the
+        device each sample came from, the ancillary data of each device and
+        any errors for each app once all of its chunks have finished.
+        Samples from chunks that failed are kept, and the failure threshold
+        applies to all of the iterations of an app.
+        """
+        jobs = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        pending = {}
+        for app_name in app_names:
+            for iterations in self.chunks(self.test_options['iterations']):
+                jobs.put((app_name, iterations))
+                pending[app_name] = pending.get(app_name, 0) + 1
+        for device in self.devices:
+            jobs.put(None)
+
+        workers = {}
+        for serial, port in self.devices:
+            worker = multiprocessing.Process(
+                target=_device_worker,
+                args=(serial, port, self.test_options, self.log_level,
+                      self.tracer.enabled, jobs, results))
+            worker.start()
+            workers[serial] = worker
+
+        merged = dict((app_name, {'results': {},
+                                  'memory': {},
+                                  'sample_devices': {},
+                                  'ancillary_data': {},
+                                  'failures': 0,
+                                  'errors': []}) for app_name in app_names)
+        fail_threshold = int(self.test_options['iterations'] * 0.2)
+        # The app each worker is measuring, and the workers that have exited
+        running = {}
+        dead = set()
+
+        def finish_chunk(app_name):
+            pending[app_name] -= 1
+            if pending[app_name]:
+                return None
+            del pending[app_name]
+            app_merged = merged.pop(app_name)
+            if app_merged['failures'] > fail_threshold and \
+                    not app_merged['errors']:
+                app_merged['errors'].append(
+                    (None, str(ExceededThresholdError())))
+            return app_merged
+
+        try:
+            while pending and len(dead) < len(workers):
+                try:
+                    message = results.get(timeout=self.poll_interval)
+                except Queue.Empty:
+                    for serial, worker in workers.iteritems():
+                        if serial in dead or worker.is_alive():
+                            continue
+                        dead.add(serial)
+                        app_name = running.pop(serial, None)
+                        if app_name is None:
+                            continue
+                        self.logger.error('Worker for %s exited with code %s '
+                                          'while measuring %s' % (
+                                              serial, worker.exitcode,
+                                              app_name))
+                        merged[app_name]['errors'].append(
+                            (serial, 'Worker exited with code %s' %
+                             worker.exitcode))
+                        app_merged = finish_chunk(app_name)
+                        if app_merged:
+                            yield app_name, app_merged
+                    continue
+                self.tracer.extend(message['events'])
+                serial = message['serial']
+                if message['app_name'] is None:
+                    # Worker was unable to connect to its device
+                    self.logger.error('Unable to use %s:\n%s' % (
+                        serial, message['error']))
+                    dead.add(serial)
+                    continue
+                app_name = message['app_name']
+                if message.get('started'):
+                    running[serial] = app_name
+                    continue
+                if running.pop(serial, None) is None:
+                    # The chunk was already given up on
+                    continue
+                app_merged = merged[app_name]
+                if message['error']:
+                    app_merged['errors'].append((serial, message['error']))
+                app_merged['failures'] += message.get('failures', 0)
+                for metric, values in message['results'].iteritems():
+                    app_merged['results'].setdefault(
+                        metric, []).extend(values)
+                    app_merged['sample_devices'].setdefault(
+                        metric, []).extend([serial] * len(values))
+                for metric, values in message['memory'].iteritems():
+                    for key, value in values.iteritems():
+                        app_merged['memory'].setdefault(
+                            metric, {}).setdefault(key, []).extend(value)
+                if message['ancillary_data']:
+                    app_merged['ancillary_data'][serial] = \
+                        message['ancillary_data']
+                app_merged = finish_chunk(app_name)
+                if app_merged:
+                    yield app_name, app_merged
+        finally:
+            for serial, worker in workers.iteritems():
+                if serial in dead:
+                    worker.join()
+                else:
+                    worker.join(self.poll_interval)
+
+        for app_name in app_names:
+            if app_name in pending:
+                merged[app_name]['errors'].append(
+                    (None, 'No devices left to measure every iteration'))
+                yield app_name, merged[app_name]
+
+
+def _device_worker(serial, port, test_options, log_level, trace, jobs,
+                   results):
+    logger = get_logger('B2GPerfRunner[%s]' % serial, log_level)
+    tracer = Tracer(enabled=trace)
+    try:
+        dm = mozdevice.DeviceManagerADB(deviceSerial=serial)
+        dm.forward('tcp:%d' % port, 'tcp:2828')
+        marionette = MarionetteSession(
+            Marionette(host='localhost', port=port), logger)
+        marionette.start_session()
+        marionette.set_script_timeout(60000)
+        marionette.set_search_timeout(60000)
+        device = gaiatest.GaiaDevice(marionette, manager=dm)
+    except Exception:
+        results.put({'app_name': None,
+                     'serial': serial,
+                     'error': traceback.format_exc(),
+                     'events': []})
+        return
+
+    for app_name, iterations in iter(jobs.get, None):
+        # Samples from every device are merged, so they must all be kept
+        # and the failure threshold applies to all iterations of the app
+        options = dict(test_options, iterations=iterations, keep_samples=True,
+                       fail_threshold=int(test_options['iterations'] * 0.2))
+        test_class = get_test_class(app_name, options.pop('test_type'))
+        tracer.events = []
+        results.put({'app_name': app_name,
+                     'serial': serial,
+                     'started': True,
+                     'events': []})
+        message = {'app_name': app_name,
+                   'serial': serial,
+                   'error': None,
+                   'results': {},
+                   'ancillary_data': {},
+                   'memory': {},
+                   'failures': 0}
+        test = None
+        try:
+            test = test_class(marionette, app_name, logger, device=device,
+                              device_serial=serial, tracer=tracer, **options)
+            with tracer.span('app', app_name=app_name, device=serial):
+                test.run()
+        except Exception:
+            message['error'] = traceback.format_exc()
+        if test:
+            # Keep whatever was measured before any failure
+            message['results'] = getattr(test, 'results', {})
+            message['ancillary_data'] = test.ancillary_data
+            message['memory'] = dict((metric, dict(
+                (key, value.samples)
+                for key, value in memory_stats.iteritems()))
+                for metric, memory_stats in test.memory.iteritems())
+            message['failures'] = getattr(test, 'fail_counter', 0)
+        message['events'] = tracer.events
+        results.put(message)
 
 
 class B2GPerfTest(object):
 
+    # Amount of each type of content to populate before running, keyed by
+    # the b2gpopulate content type
+    fixtures = {}
+
+    # Lost sessions beyond this count against the failure threshold
+    max_recoveries = 5
+
     def __init__(self, marionette, app_name, logger, iterations, delay,
                  device, restart, settle_time, testvars, reset, start_timeout,
-                 device_serial):
+                 device_serial, keep_samples=True, target_precision=None,
+                 min_iterations=10, fixture_cache=None, tracer=None,
+                 settle_window=None, bulk_media=False, fail_threshold=None):
         self.marionette = marionette
         self.app_name = app_name
         self.logger = logger
@@ -238,8 +829,33 @@ class B2GPerfTest(object):
         self.start_timeout = start_timeout
         self.requires_connection = False
         self.device_serial = device_serial
-        self.b2gpopulate = B2GPopulate(self.marionette,
-                                       device_serial=self.device_serial)
+        # The stopping rule needs the samples to bound the median
+        self.keep_samples = keep_samples or bool(target_precision)
+        self.target_precision = target_precision
+        self.min_iterations = min_iterations
+        self.fixture_cache = fixture_cache
+        self.tracer = tracer or Tracer(enabled=False)
+        self.settle_window = settle_window
+        self.bulk_media = bulk_media
+        # Failures allowed before giving up, a fifth of the iterations if
+        # not given
+        self.max_failures = fail_threshold
+        self.ancillary_data = {}
+        # Memory statistics keyed by metric and then '<app>_memory'
+        self.memory = {}
+        self.metrics = []
+        # Metrics that are recorded when present but do not fail an iteration
+        self.optional_metrics = []
+        self.recoveries = 0
+        self._b2gpopulate = None
+
+    @property
+    def b2gpopulate(self):
+        # Only connect to the device for content when it is needed
+        if self._b2gpopulate is None:
+            self._b2gpopulate = B2GPopulate(self.marionette,
+                                            device_serial=self.device_serial)
+        return self._b2gpopulate
 
     def connect_to_network(self):
         while not self.device.is_online:
@@ -254,161 +870,581 @@ class B2GPerfTest(object):
         self.logger.debug('Connected to network')
 
     def populate_databases(self):
-        self.logger.debug('No databases to populate')
+        databases = [f for f in DATABASE_FIXTURES if f in self.fixtures]
+        if not databases:
+            self.logger.debug('No databases to populate')
+        for fixture in databases:
+            populate = getattr(self.b2gpopulate, 'populate_%s' % fixture)
+            populate(self.fixtures[fixture], restart=False)
 
     def populate_files(self):
-        self.logger.debug('No files to populate')
+        files = [f for f in FILE_FIXTURES if f in self.fixtures]
+        if not files:
+            self.logger.debug('No files to populate')
+        for fixture in files:
+            if self.bulk_media:
+                media = MediaPopulator(self.b2gpopulate, self.device.manager,
+                                       self.logger)
+                media.populate(fixture, self.fixtures[fixture])
+                continue
+            populate = getattr(self.b2gpopulate, 'populate_%s' % fixture)
+            populate(self.fixtures[fixture])
+
+    def populate(self, phase, remote_paths):
+        """Populate databases or files, restoring them from the fixture cache
+        after a reset if they have been captured before. Files already on
+        the device from an earlier run are not pushed again."""
+        populate = getattr(self, 'populate_%s' % phase)
+        kinds = FILE_FIXTURES if phase == 'files' else DATABASE_FIXTURES
+        if not any(kind in self.fixtures for kind in kinds):
+            return populate()
+
+        key = fixture_key(self.__class__, self.fixtures)
+        cache = None
+        if self.fixture_cache:
+            cache = FixtureCache(self.fixture_cache, self.device.manager,
+                                 self.logger)
+
+        manifest = None
+        if phase == 'files':
+            manifest = ContentManifest(self.device.manager, self.logger)
+            expected = manifest.expected(key)
+            if expected:
+                missing = expected - manifest.list_files(remote_paths)
+                if not missing:
+                    self.logger.debug('All %d files already present' %
+                                      len(expected))
+                    return
+                if len(missing) < len(expected) and cache and \
+                   cache.restore_files(key, phase,
+                                       [path for path, size in missing]):
+                    return
+
+        if self.reset and cache and cache.restore(key, phase, remote_paths):
+            return
+
+        if manifest:
+            before = manifest.list_files(remote_paths)
+        populate()
+        if manifest:
+            added = manifest.list_files(remote_paths) - before
+            count = sum(self.fixtures.get(kind, 0) for kind in kinds)
+            if len(added) >= count:
+                manifest.record(key, added)
+            else:
+                # Some content replaced files that were already there, so
+                # the populated set is unknown until storage is reset
+                self.logger.debug('Unable to record content manifest')
+        if self.reset and cache:
+            cache.capture(key, phase, remote_paths)
 
     def setup(self):
         if self.restart:
             self.logger.debug('Stopping B2G')
-            self.device.stop_b2g()
+            with self.tracer.span('stop b2g'):
+                self.device.stop_b2g()
 
         if self.reset:
-            self.logger.debug('Removing persistent storage')
-            self.device.file_manager.remove('/data/local/storage/persistent')
-            self.device.file_manager.remove('/data/local/indexedDB')
-
-            self.logger.debug('Removing profile')
-            self.device.file_manager.remove('/data/b2g/mozilla')
-
-            self.logger.debug('Removing files from storage')
-            # TODO: Remove hard-coded paths once bug 1018079 is resolved
-            for path in ['/mnt/sdcard',
-                         '/mnt/extsdcard',
-                         '/storage/sdcard',
-                         '/storage/sdcard0',
-                         '/storage/sdcard1']:
-                if self.device.file_manager.dir_exists(path):
-                    for item in self.device.file_manager.list_items(path):
-                        self.device.file_manager.remove('/'.join([path, item]))
+            with self.tracer.span('reset'):
+                self.logger.debug('Removing persistent storage')
+                self.device.file_manager.remove(
+                    '/data/local/storage/persistent')
+                self.device.file_manager.remove('/data/local/indexedDB')
+
+                self.logger.debug('Removing profile')
+                self.device.file_manager.remove('/data/b2g/mozilla')
+
+                self.logger.debug('Removing files from storage')
+                for path in STORAGE_PATHS:
+                    if self.device.file_manager.dir_exists(path):
+                        for item in self.device.file_manager.list_items(path):
+                            self.device.file_manager.remove(
+                                '/'.join([path, item]))
 
         self.logger.debug('Populating databases')
-        self.populate_databases()
+        with self.tracer.span('populate databases'):
+            self.populate('databases', DATABASE_PATHS)
 
         if self.restart:
             self.logger.debug('Starting B2G')
-            self.device.start_b2g(self.start_timeout)
-
-        self.apps = gaiatest.GaiaApps(self.marionette)
-        self.data_layer = gaiatest.GaiaData(self.marionette)
+            with self.tracer.span('start b2g'):
+                self.device.start_b2g(self.start_timeout)
 
         self.logger.debug('Populating files')
-        self.populate_files()
+        with self.tracer.span('populate files'):
+            self.populate('files', STORAGE_PATHS)
 
-        self.logger.debug('Settling for %d seconds' % self.settle_time)
-        time.sleep(self.settle_time)
+        with self.tracer.span('settle'):
+            self.settle()
 
-        self.marionette.switch_to_frame()
+        self.prepare()
 
+    def prepare(self, prepare_device=True):
+        """Get ready to measure once B2G is running and has settled. This is
+        all the setup each test needs when the device is shared, in which
+        case the device has already been prepared."""
+        self.apps = gaiatest.GaiaApps(self.marionette)
+        self.data_layer = gaiatest.GaiaData(self.marionette)
+        self.marionette.switch_to_frame()
+        if prepare_device:
+            with self.tracer.span('prepare device'):
+                self.prepare_device()
+
+    def settle(self):
+        if self.settle_window:
+            self.logger.debug('Settling until idle for %d seconds, for up to '
+                              '%d seconds' % (self.settle_window,
+                                              self.settle_time))
+            monitor = QuiescenceMonitor(self.device.manager, self.logger)
+            settled = monitor.wait(self.settle_window, self.settle_time)
+        else:
+            self.logger.debug('Settling for %d seconds' % self.settle_time)
+            time.sleep(self.settle_time)
+            settled = self.settle_time
+        self.logger.debug('Settled after %.1f seconds' % settled)
+        self.ancillary_data['settled_after'] = round(settled, 1)
+
+    def prepare_device(self):
+        """Prepare the device for launching apps in a single script,
+        falling back to separate calls for any step that did not succeed."""
         safe_volume = 5
-        self.logger.debug('Setting content volume to %d' % safe_volume)
-        self.data_layer.set_setting('audio.volume.content', safe_volume)
-
-        self.logger.debug('Switching off keyboard first time use screen')
-        self.data_layer.set_setting('keyboard.ftu.enabled', False)
-
-        self.logger.debug('Unlocking device')
-        self.device.unlock()
-
-        self.logger.debug('Killing all running apps')
-        self.apps.kill_all()
-
-        self.logger.debug('Returning to home screen')
-        self.marionette.execute_script(
-            'window.wrappedJSObject.dispatchEvent(new Event("home"));')
+        steps = {}
+        try:
+            self.marionette.import_script(pkg_resources.resource_filename(
+                __name__, 'preparedevice.js'))
+            steps = self.marionette.execute_async_script(
+                'prepareDevice(%d)' % safe_volume, special_powers=True) or {}
+        except MarionetteException:
+            traceback.print_exc()
+        for step, result in sorted(steps.items()):
+            self.logger.debug('Device preparation step %s: %s' % (
+                step, 'ok' if result else 'failed'))
+
+        if not steps.get('volume'):
+            self.logger.debug('Setting content volume to %d' % safe_volume)
+            self.data_layer.set_setting('audio.volume.content', safe_volume)
+
+        if not steps.get('keyboard_ftu'):
+            self.logger.debug('Switching off keyboard first time use screen')
+            self.data_layer.set_setting('keyboard.ftu.enabled', False)
+
+        if not steps.get('screen_timeout'):
+            self.logger.debug('Switching off screen timeout')
+            self.data_layer.set_setting('screen.timeout', 0)
+
+        if not steps.get('unlock'):
+            self.logger.debug('Unlocking device')
+            self.device.unlock()
+
+        if not steps.get('kill_all'):
+            self.logger.debug('Killing all running apps')
+            self.apps.kill_all()
+
+        if not steps.get('home'):
+            self.logger.debug('Returning to home screen')
+            self.marionette.execute_script(
+                'window.wrappedJSObject.dispatchEvent(new Event("home"));')
 
     def run(self):
+        self.start()
+        while not self.finished(self.success_counter):
+            self.step()
+        self.finish()
+
+    def start(self, setup=True):
+        """Set up the device and reset the results. Without setup, the
+        device is assumed to have been set up and prepared already."""
         self.logger.info('Running %s' % self.__class__.__name__)
-        self.setup()
+        if setup:
+            with self.tracer.span('setup'):
+                self.setup()
+        else:
+            self.prepare(prepare_device=False)
         self.results = {}
-        success_counter = 0
-        fail_counter = 0
-        fail_threshold = int(self.iterations * 0.2)
-
-        for i in range(self.iterations + fail_threshold):
-            while not success_counter == self.iterations:
-                try:
-                    if self.requires_connection:
-                        self.logger.debug('Connecting to network')
-                        self.connect_to_network()
-
-                    self.logger.debug('Waiting for %d seconds' % self.delay)
-                    time.sleep(self.delay)
-                    self.test()
-                    for metric in self.metrics:
-                        if self.result.get(metric):
-                            value = self.result.get(metric)
-                            self.logger.debug("Metric '%s' returned: %s" % (
-                                metric, value))
-                            self.results.setdefault(metric, []).append(value)
-                        else:
-                            raise MissingMetricError(self.app_name, metric, i)
-                    success_counter += 1
-                    self.logger.info('%s [%s/%d]' % (self.app_name,
-                                                     success_counter,
-                                                     self.iterations))
-                except (B2GPerfError, MarionetteException):
-                    traceback.print_exc()
-                    fail_counter += 1
-                    self.logger.debug('Exception within failure threshold')
-                    if fail_counter > fail_threshold:
-                        raise ExceededThresholdError()
+        self.stats = {}
+        self.success_counter = 0
+        self.fail_counter = 0
+        self.fail_threshold = self.max_failures
+        if self.fail_threshold is None:
+            self.fail_threshold = int(self.iterations * 0.2)
+
+    def step(self):
+        """Run a single iteration and record its results. Returns False if
+        the iteration failed within the failure threshold."""
+        attempt = self.success_counter + self.fail_counter
+        try:
+            if self.requires_connection:
+                self.logger.debug('Connecting to network')
+                self.connect_to_network()
+
+            self.logger.debug('Waiting for %d seconds' % self.delay)
+            with self.tracer.span('delay'):
+                time.sleep(self.delay)
+            with self.tracer.span('iteration',
+                                  iteration=self.success_counter + 1):
+                self.test()
+            for metric in self.metrics:
+                if not self.result.get(metric):
+                    raise MissingMetricError(self.app_name, metric, attempt)
+            for metric in self.metrics + self.optional_metrics:
+                value = self.result.get(metric)
+                if value is None:
+                    continue
+                self.logger.debug("Metric '%s' returned: %s" % (
+                    metric, value))
+                self.record(metric, value)
+            for metric, value in (self.result.get('memory') or
+                                  {}).iteritems():
+                self.record_memory(metric, value)
+            self.success_counter += 1
+            self.logger.info('%s [%s/%d] %s' % (
+                self.app_name, self.success_counter, self.iterations,
+                self.running_summary()))
+            return True
+        except (B2GPerfError,) + CONNECTION_ERRORS:
+            traceback.print_exc()
+            if self.recover() and self.recoveries <= self.max_recoveries:
+                # Losing the session is not a failure of the app, unless it
+                # keeps happening
+                return False
+            self.fail_counter += 1
+            self.logger.debug('Exception within failure threshold')
+            if self.fail_counter > self.fail_threshold:
+                raise ExceededThresholdError()
+            return False
+
+    def finish(self):
+        if self.target_precision:
+            self.ancillary_data['adaptive'] = {
+                'stopped_by': self.stopped_by,
+                'iterations': self.success_counter,
+                'target_precision': self.target_precision,
+                'achieved_precision': self.precision()}
+            self.logger.info(
+                'Stopped %s after %d iterations (%s), median precision %s' % (
+                    self.app_name, self.success_counter, self.stopped_by,
+                    self.precision()))
         self.teardown()
 
+    def recover(self):
+        """Reconnect and prepare the device again if the Marionette session
+        has been lost. Returns False if the session was healthy, or if it
+        could not be reconnected."""
+        recover = getattr(self.marionette, 'recover', None)
+        if not recover:
+            return False
+        with self.tracer.span('recover'):
+            if not recover(self.start_timeout):
+                return False
+            self.recoveries += 1
+            self.ancillary_data['recoveries'] = self.recoveries
+            try:
+                self.settle()
+                self.prepare()
+            except CONNECTION_ERRORS:
+                traceback.print_exc()
+                return False
+        return True
+
+    def finished(self, iterations):
+        if iterations >= self.iterations:
+            self.stopped_by = 'max_iterations'
+            return True
+        if self.target_precision and iterations >= self.min_iterations:
+            precision = self.precision()
+            if precision is not None and precision <= self.target_precision:
+                self.stopped_by = 'precision'
+                return True
+        return False
+
+    def precision(self):
+        """Width of the 95% confidence interval of the median of the primary
+        metric, relative to the median."""
+        stats = self.stats.get(self.metrics[0])
+        interval = stats and stats.median_confidence_interval()
+        if not interval or not stats.median:
+            return None
+        return (interval[1] - interval[0]) / float(stats.median)
+
+    def record(self, metric, value):
+        if metric not in self.stats:
+            self.stats[metric] = RunningStats(keep_samples=self.keep_samples)
+            if self.keep_samples:
+                self.results[metric] = self.stats[metric].samples
+        self.stats[metric].add(value)
+
+    def record_memory(self, metric, value):
+        memory_stats = self.memory.setdefault(metric, {})
+        key = '%s_memory' % self.app_name
+        if key not in memory_stats:
+            memory_stats[key] = RunningStats(keep_samples=self.keep_samples)
+        memory_stats[key].add(value)
+
+    def running_summary(self):
+        return ', '.join('%s median:%d, p90:%d, std:%d' % (
+            metric, stats.median, stats.p90, stats.std)
+            for metric, stats in sorted(self.stats.items()))
+
     def teardown(self):
         pass
 
 
 class B2GPerfLaunchTest(B2GPerfTest):
 
+    # Cold launches start the app from scratch and kill it afterwards. Warm
+    # launches send the app to the background and bring it back, and mixed
+    # launches measure one of each per iteration.
+    launch_mode = 'cold'
+    launch_metrics = {'cold': ['cold_load_time'],
+                      'warm': ['warm_load_time'],
+                      'mixed': ['cold_load_time', 'warm_load_time']}
+
+    # Metrics for each stage of a cold launch, gathered with milestones
+    milestone_metrics = ['first_paint_time', 'opened_time',
+                         'fully_loaded_time']
+
     def __init__(self, *args, **kwargs):
+        launch_mode = kwargs.pop('launch_mode', None)
+        self.milestones = kwargs.pop('milestones', False)
+        self.sample_memory = kwargs.pop('sample_memory', False)
+        self.fused_launch = kwargs.pop('fused_launch', False)
         B2GPerfTest.__init__(self, *args, **kwargs)
-        self.metrics = ['cold_load_time']
-
-    def setup(self):
-        B2GPerfTest.setup(self)
+        self.launch_mode = launch_mode or self.launch_mode
+        self.metrics = self.launch_metrics[self.launch_mode]
+        if self.milestones:
+            self.optional_metrics = self.milestone_metrics
+        self.running_origin = None
+        self.app_entry = None
+
+    def prepare(self, prepare_device=True):
+        B2GPerfTest.prepare(self, prepare_device)
         self.marionette.import_script(
             pkg_resources.resource_filename(__name__, 'launchapp.js'))
-
-    def test(self):
-        self.logger.debug("Launching '%s'" % self.app_name)
-        self.result = self.marionette.execute_async_script(
-            'launch("%s")' % self.app_name)
-        if not self.result:
+        with self.tracer.span('app index'):
+            index = get_app_index(self.marionette, self.device_serial,
+                                  get_build_id(self.device.manager))
+        self.app_entry = index.lookup(self.app_name)
+        if not self.app_entry:
+            self.logger.debug("'%s' is not in the app index, it will be "
+                              "located by name on each launch" %
+                              self.app_name)
+
+    def launch(self, kill=False):
+        """Launch the app and return its load times. With kill, the app is
+        also killed before the script returns."""
+        self.logger.debug("Launching '%s'%s" % (
+            self.app_name, ' and killing it' if kill else ''))
+        with self.tracer.span('launch'):
+            result = self.marionette.execute_async_script(
+                '%s("%s", %s, %s)' % ('launchAndKill' if kill else 'launch',
+                                      self.app_name,
+                                      'true' if self.milestones else 'false',
+                                      json.dumps(self.app_entry)))
+        if not result:
             raise AppLaunchError()
+        self.running_origin = None if kill else result.get('origin')
+        return result
+
+    def measure_memory(self):
+        if not self.sample_memory:
+            return
+        with self.tracer.span('memory'):
+            sampler = MemorySampler(self.device.manager, self.logger)
+            self.result['memory'] = sampler.sample(self.result.get('name'))
+
+    def background(self):
+        self.logger.debug("Sending '%s' to the background" % self.app_name)
+        with self.tracer.span('background'):
+            self.marionette.execute_async_script(
+                'background("%s")' % self.running_origin)
+
+    def kill(self):
         self.logger.debug("Killing '%s'" % self.app_name)
-        self.apps.kill(gaiatest.GaiaApp(origin=self.result.get('origin')))
+        with self.tracer.span('kill'):
+            self.apps.kill(gaiatest.GaiaApp(origin=self.running_origin))
+        self.running_origin = None
+
+    def test(self):
+        # Memory can only be sampled while the app is running, so it needs
+        # separate launch and kill scripts
+        fused = self.fused_launch and not self.sample_memory
+        if self.launch_mode == 'warm':
+            if not self.running_origin:
+                # The first launch only gets the app running
+                self.launch()
+                self.background()
+            self.result = self.launch()
+            self.measure_memory()
+            self.background()
+        elif self.launch_mode == 'mixed':
+            self.result = self.launch()
+            self.background()
+            if fused:
+                self.result.update(self.launch(kill=True))
+            else:
+                self.result.update(self.launch())
+                self.measure_memory()
+                self.kill()
+        elif fused:
+            self.result = self.launch(kill=True)
+        else:
+            self.result = self.launch()
+            self.measure_memory()
+            self.kill()
+
+    def recover(self):
+        recovered = B2GPerfTest.recover(self)
+        if recovered:
+            # Preparing the device again killed the app
+            self.running_origin = None
+        return recovered
+
+    def teardown(self):
+        if self.running_origin:
+            self.kill()
+
+
+class B2GPerfWarmLaunchTest(B2GPerfLaunchTest):
+
+    launch_mode = 'warm'
+
+
+class B2GPerfMixedLaunchTest(B2GPerfLaunchTest):
+
+    launch_mode = 'mixed'
 
 
 class B2GPerfLaunchContactsTest(B2GPerfLaunchTest):
 
-    def populate_databases(self):
-        self.b2gpopulate.populate_contacts(200, restart=False)
+    fixtures = {'contacts': 200}
 
 
 class B2GPerfLaunchGalleryTest(B2GPerfLaunchTest):
 
-    def populate_files(self):
-        self.b2gpopulate.populate_pictures(700)
+    fixtures = {'pictures': 700}
 
 
 class B2GPerfLaunchMessagesTest(B2GPerfLaunchTest):
 
-    def populate_databases(self):
-        self.b2gpopulate.populate_messages(200, restart=False)
+    fixtures = {'messages': 200}
 
 
 class B2GPerfLaunchMusicTest(B2GPerfLaunchTest):
 
-    def populate_files(self):
-        self.b2gpopulate.populate_music(500)
+    fixtures = {'music': 500}
 
 
 class B2GPerfLaunchVideoTest(B2GPerfLaunchTest):
 
-    def populate_files(self):
-        self.b2gpopulate.populate_videos(100)
+    fixtures = {'videos': 100}
+
+
+class B2GPerfScrollTest(B2GPerfLaunchTest):
+    """Measures the frame rate while scrolling through the app's content.
+    The app is launched once, and each iteration scrolls down and back up
+    again. If another app has been displayed since the last iteration, the
+    app is brought back to the foreground first."""
+
+    # CSS selector of the element to scroll. Without one, the element with
+    # the most content to scroll is used.
+    scroll_selector = None
+    # Pixels to scroll each frame, and the furthest distance to scroll
+    scroll_step = 20
+    scroll_distance = 10000
+
+    frame_metrics = ['frame_time_median', 'frame_time_p95',
+                     'frame_time_p99', 'jank_count']
+
+    def __init__(self, *args, **kwargs):
+        B2GPerfLaunchTest.__init__(self, *args, **kwargs)
+        self.metrics = ['fps']
+        self.optional_metrics = self.frame_metrics
+        self.app_window = None
+
+    def prepare(self, prepare_device=True):
+        B2GPerfLaunchTest.prepare(self, prepare_device)
+        self.marionette.import_script(
+            pkg_resources.resource_filename(__name__, 'scrollapp.js'))
+
+    def scroll(self):
+        """Scroll the app and return statistics of its frame times."""
+        self.logger.debug("Scrolling '%s'" % self.app_name)
+        with self.tracer.span('scroll'):
+            self.marionette.switch_to_frame(self.app_window.get('frame'))
+            try:
+                result = self.marionette.execute_async_script(
+                    'scroll(%s, %d, %d)' % (json.dumps(self.scroll_selector),
+                                            self.scroll_step,
+                                            self.scroll_distance))
+            finally:
+                self.marionette.switch_to_frame()
+        if not result:
+            raise ScrollError()
+        self.logger.debug('Scrolled %d pixels in %d frames' % (
+            result['distance'], len(result['frame_times'])))
+        return frame_statistics(result['frame_times'])
+
+    def displayed(self):
+        """Whether the app is running and displayed. Other tests sharing the
+        device launch their own apps between iterations, and a hidden app
+        stops painting frames."""
+        if not self.running_origin:
+            return False
+        return self.apps.displayed_app.origin == self.running_origin
+
+    def test(self):
+        if not self.displayed():
+            # The app stays open between iterations
+            self.app_window = self.launch()
+        self.result = self.scroll()
+        self.result['name'] = self.app_window.get('name')
+        self.measure_memory()
+
+
+class B2GPerfScrollContactsTest(B2GPerfScrollTest):
+
+    fixtures = {'contacts': 200}
+
+
+class B2GPerfScrollGalleryTest(B2GPerfScrollTest):
+
+    fixtures = {'pictures': 700}
+
+
+class B2GPerfScrollMessagesTest(B2GPerfScrollTest):
+
+    fixtures = {'messages': 200}
+
+
+class B2GPerfScrollMusicTest(B2GPerfScrollTest):
+
+    fixtures = {'music': 500}
+
+
+def get_test_class(app_name, test_type='launch'):
+    tests = {
+        'launch': {
+            'contacts': B2GPerfLaunchContactsTest,
+            'gallery': B2GPerfLaunchGalleryTest,
+            'messages': B2GPerfLaunchMessagesTest,
+            'music': B2GPerfLaunchMusicTest,
+            'video': B2GPerfLaunchVideoTest},
+        'scroll': {
+            'contacts': B2GPerfScrollContactsTest,
+            'gallery': B2GPerfScrollGalleryTest,
+            'messages': B2GPerfScrollMessagesTest,
+            'music': B2GPerfScrollMusicTest}}
+    default = {'launch': B2GPerfLaunchTest,
+               'scroll': B2GPerfScrollTest}
+    return tests[test_type].get(app_name.lower(), default[test_type])
+
+
+def get_logger(name, log_level):
+    handler = mozlog.StreamHandler()
+    handler.setFormatter(mozlog.MozFormatter(include_timestamp=True))
+    logger = mozlog.getLogger(name, handler)
+    logger.setLevel(getattr(mozlog, log_level.upper()))
+    return logger
 
 
 class dzOptionParser(OptionParser):
@@ -455,12 +1491,27 @@ class dzOptionParser(OptionParser):
                         dest='datazilla_build_url',
                         metavar='str',
                         help='url of the build generating the results')
+        self.add_option('--dz-spool',
+                        action='store',
+                        dest='datazilla_spool',
+                        metavar='str',
+                        help='directory to queue datazilla submissions in. '
+                             'Submissions are uploaded in the background and '
+                             'any left over are sent on the next run. '
+                             'Submissions that are rejected are moved to a '
+                             'failed subdirectory')
         self.add_option('--sources',
                         action='store',
                         dest='sources',
                         metavar='str',
                         help='path to sources.xml containing project '
                              'revisions')
+        self.add_option('--metadata-cache',
+                        action='store',
+                        dest='metadata_cache',
+                        metavar='str',
+                        help='directory to cache device and build details in, '
+                             'so they are only queried once for each build')
 
     def datazilla_config(self, options):
         if options.sources:
@@ -477,7 +1528,8 @@ class dzOptionParser(OptionParser):
             'device_name': options.datazilla_device_name,
             'oauth_key': options.datazilla_key,
             'oauth_secret': options.datazilla_secret,
-            'build_url': options.datazilla_build_url}
+            'build_url': options.datazilla_build_url,
+            'spool': options.datazilla_spool}
         return datazilla_config
 
 
@@ -494,6 +1546,31 @@ def cli():
                       dest='device_serial',
                       metavar='str',
                       help='serial identifier of device to target')
+    parser.add_option('--devices',
+                      action='store',
+                      dest='devices',
+                      metavar='str',
+                      help='comma separated list of serial:port pairs to '
+                           'spread iterations across, using one process per '
+                           'device')
+    parser.add_option('--shared-setup',
+                      action='store_true',
+                      dest='shared_setup',
+                      default=False,
+                      help='set up the device once with the content needed '
+                           'by all apps, instead of once per app')
+    parser.add_option('--app-order',
+                      action='store',
+                      type='choice',
+                      choices=['interleaved', 'shuffled', 'sequential'],
+                      dest='app_order',
+                      default='interleaved',
+                      metavar='str',
+                      help='order to measure apps in with --shared-setup. '
+                           'interleaved measures each app in turn for every '
+                           'iteration, shuffled does the same in a random '
+                           'order and sequential runs all iterations of one '
+                           'app before the next (default: %default)')
     parser.add_option('--delay',
                       action='store',
                       type='float',
@@ -510,6 +1587,64 @@ def cli():
                       metavar='int',
                       help='number of times to launch each app '
                            '(default: %default)')
+    parser.add_option('--target-precision',
+                      action='store',
+                      type='float',
+                      dest='target_precision',
+                      metavar='float',
+                      help='stop launching an app once the 95%% confidence '
+                           'interval of the median load time is within this '
+                           'fraction of the median, with --iterations as the '
+                           'maximum (e.g. 0.05)')
+    parser.add_option('--min-iterations',
+                      action='store',
+                      type=int,
+                      dest='min_iterations',
+                      default=10,
+                      metavar='int',
+                      help='minimum number of times to launch each app when '
+                           'using --target-precision (default: %default)')
+    parser.add_option('--test-type',
+                      action='store',
+                      type='choice',
+                      choices=['launch', 'scroll'],
+                      dest='test_type',
+                      default='launch',
+                      metavar='str',
+                      help='launch tests time app launches, and scroll tests '
+                           'report the frame rate, frame times and jank while '
+                           'scrolling each app (default: %default)')
+    parser.add_option('--launch-mode',
+                      action='store',
+                      type='choice',
+                      choices=['cold', 'warm', 'mixed'],
+                      dest='launch_mode',
+                      default='cold',
+                      metavar='str',
+                      help='cold launches kill the app after each launch, '
+                           'warm launches send it to the background and '
+                           'launch it again, and mixed measures both in '
+                           'each iteration (default: %default)')
+    parser.add_option('--milestones',
+                      action='store_true',
+                      dest='milestones',
+                      default=False,
+                      help='also report the time to first paint, to the app '
+                           'window opening and to the app being fully loaded '
+                           'for each cold launch')
+    parser.add_option('--memory',
+                      action='store_true',
+                      dest='sample_memory',
+                      default=False,
+                      help='report the uss, pss and rss of each app after it '
+                           'has launched')
+    parser.add_option('--fused-launch',
+                      action='store_true',
+                      dest='fused_launch',
+                      default=False,
+                      help='launch and kill each app in a single script, '
+                           'saving a round trip to the device per launch. '
+                           'Not used with --memory')
     parser.add_option('--log-level',
                       action='store',
                       dest='log_level',
@@ -529,6 +1664,15 @@ def cli():
                       metavar='float',
                       help='time to wait before initial launch '
                            '(default: %default)')
+    parser.add_option('--settle-window',
+                      action='store',
+                      type='float',
+                      dest='settle_window',
+                      metavar='float',
+                      help='instead of waiting for the full settle time, '
+                           'launch once the device has been idle for this '
+                           'many seconds. The settle time is the maximum '
+                           'time to wait')
     parser.add_option('--start-timeout',
                       action='store',
                       type=int,
@@ -541,6 +1685,13 @@ def cli():
                       dest='testvars',
                       metavar='str',
                       help='path to a json file with any test data required'),
+    parser.add_option('--keep-samples',
+                      action='store_true',
+                      dest='keep_samples',
+                      default=False,
+                      help='keep every sample in memory and include them in '
+                           'the results summary. Samples are always kept '
+                           'when submitting to DataZilla')
     parser.add_option('--reset',
                       action='store_true',
                       dest='reset',
@@ -548,6 +1699,59 @@ def cli():
                       help='reset the target to a clean state between tests '
                            '(requires restart). WARNING: any personal data '
                            'will be removed!')
+    parser.add_option('--trace',
+                      action='store',
+                      dest='trace',
+                      metavar='str',
+                      help='path to write a chrome trace event file of the '
+                           'time spent in each phase of the run to')
+    parser.add_option('--archive',
+                      action='store',
+                      dest='archive',
+                      metavar='str',
+                      help='path of a SQLite database to store the samples '
+                           'and details of every run in. Summaries can be '
+                           'queried with b2gperf-archive')
+    parser.add_option('--baseline',
+                      action='store',
+                      dest='baseline',
+                      metavar='str',
+                      help='path of results saved with --save-results to '
+                           'compare against. The exit code is %d if any '
+                           'metric has regressed' % REGRESSION_EXIT_CODE)
+    parser.add_option('--save-results',
+                      action='store',
+                      dest='save_results',
+                      metavar='str',
+                      help='path to save the samples of this run to, for use '
+                           'as a later baseline')
+    parser.add_option('--verdict',
+                      action='store',
+                      dest='verdict',
+                      metavar='str',
+                      help='path to write the comparison with the baseline to '
+                           'as JSON')
+    parser.add_option('--regression-threshold',
+                      action='store',
+                      type='float',
+                      dest='regression_threshold',
+                      default=0,
+                      metavar='float',
+                      help='smallest relative change in a median treated as '
+                           'a regression or improvement (default: %default)')
+    parser.add_option('--bulk-media',
+                      action='store_true',
+                      dest='bulk_media',
+                      default=False,
+                      help='populate music, pictures and videos with a single '
+                           'transfer and shell command each')
+    parser.add_option('--fixture-cache',
+                      action='store',
+                      dest='fixture_cache',
+                      metavar='str',
+                      help='directory to cache populated content in. When '
+                           'used with --reset, content is restored from the '
+                           'cache instead of being populated again')
     options, args = parser.parse_args()
 
     if not args:
@@ -571,6 +1775,21 @@ def cli():
     if options.reset and not options.restart:
         raise B2GPerfError('--reset requires restart')
 
+    if options.target_precision and options.devices:
+        raise B2GPerfError('--target-precision can not be used with --devices')
+
+    if options.shared_setup and options.devices:
+        raise B2GPerfError('--shared-setup can not be used with --devices')
+
+    if options.test_type != 'launch' and (
+            options.launch_mode != 'cold' or options.milestones or
+            options.fused_launch):
+        raise B2GPerfError('--launch-mode, --milestones and --fused-launch '
+                           'only apply to launch tests')
+
+    if options.baseline and not os.path.exists(options.baseline):
+        raise B2GPerfError('--baseline file does not exist')
+
     datazilla_config = parser.datazilla_config(options)
 
     try:
@@ -578,11 +1797,27 @@ def cli():
     except ValueError:
         raise B2GPerfError('--address must be in the format host:port')
 
+    devices = []
+    if options.devices:
+        for device in options.devices.split(','):
+            try:
+                serial, device_port = device.split(':')
+                devices.append((serial, int(device_port)))
+            except ValueError:
+                raise B2GPerfError('--devices must be a comma separated list '
+                                   'of serial:port pairs')
+        # Gather the build details for the report from the first device
+        options.device_serial, port = devices[0]
+        host = 'localhost'
+        dm = mozdevice.DeviceManagerADB(deviceSerial=options.device_serial)
+        dm.forward('tcp:%d' % port, 'tcp:2828')
+
     marionette = Marionette(host=host, port=int(port))
     marionette.start_session()
     b2gperf = B2GPerfRunner(marionette,
                             datazilla_config=datazilla_config,
                             sources=options.sources,
+                            metadata_cache=options.metadata_cache,
                             log_level=options.log_level,
                             delay=options.delay,
                             iterations=options.iterations,
@@ -591,8 +1826,31 @@ def cli():
                             testvars=testvars,
                             reset=options.reset,
                             start_timeout=options.start_timeout,
-                            device_serial=options.device_serial)
-    b2gperf.measure_app_perf(args)
+                            device_serial=options.device_serial,
+                            devices=devices,
+                            keep_samples=options.keep_samples,
+                            target_precision=options.target_precision,
+                            min_iterations=options.min_iterations,
+                            fixture_cache=options.fixture_cache,
+                            trace=options.trace,
+                            settle_window=options.settle_window,
+                            launch_mode=options.launch_mode,
+                            milestones=options.milestones,
+                            sample_memory=options.sample_memory,
+                            fused_launch=options.fused_launch,
+                            shared_setup=options.shared_setup,
+                            app_order=options.app_order,
+                            bulk_media=options.bulk_media,
+                            test_type=options.test_type,
+                            archive=options.archive,
+                            baseline=options.baseline,
+                            save_results=options.save_results,
+                            verdict=options.verdict,
+                            regression_threshold=options.regression_threshold)
+    try:
+        b2gperf.measure_app_perf(args)
+    finally:
+        b2gperf.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,259 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Measures the overhead of b2gperf itself by running tests and submitting
+results against the stand-ins in fake.py."""
+
+import json
+from optparse import OptionParser
+import random
+
+from b2gperf import B2GPerfError
+from b2gperf import B2GPerfLaunchTest
+from b2gperf import B2GPerfScrollTest
+from b2gperf import DatazillaPerfPoster
+from b2gperf import get_logger
+from fake import FakeDatazillaServer
+from fake import FakeGaiaDevice
+from fake import FakeMarionette
+from fake import LatencyModel
+from metadata import offline_metadata
+from session import MarionetteSession
+from tracing import Tracer
+
+
+def benchmark_test(options, logger, tracer):
+    """Runs a launch or scroll test against a fake device and returns its
+    samples."""
+    random_state = random.Random(options.seed)
+    marionette = FakeMarionette(
+        load_time=LatencyModel(options.load_time, options.spread,
+                               options.distribution, random_state),
+        round_trip=options.round_trip / 1000.0,
+        failure_rate=options.failure_rate,
+        error_rate=options.error_rate,
+        session_loss_rate=options.session_loss_rate,
+        seed=options.seed,
+        apps=[options.app_name])
+    session = MarionetteSession(marionette, logger)
+    session.start_session()
+    test_class = {'launch': B2GPerfLaunchTest,
+                  'scroll': B2GPerfScrollTest}[options.test_type]
+    test = test_class(session, options.app_name, logger,
+                      iterations=options.iterations,
+                      delay=0,
+                      device=FakeGaiaDevice(session),
+                      restart=True,
+                      settle_time=0,
+                      testvars={},
+                      reset=False,
+                      start_timeout=60,
+                      device_serial=None,
+                      tracer=tracer,
+                      launch_mode=options.launch_mode,
+                      milestones=options.milestones,
+                      sample_memory=options.sample_memory,
+                      fused_launch=options.fused_launch)
+    with tracer.span('run'):
+        test.run()
+    return test.results
+
+
+def benchmark_post(options, results, tracer):
+    """Submits the results to a local DataZilla stand-in."""
+    server = FakeDatazillaServer()
+    try:
+        datazilla_config = {
+            'protocol': 'http',
+            'host': server.host,
+            'project': 'b2gperf',
+            'branch': 'benchmark',
+            'machine_name': 'benchmark',
+            'device_name': 'fake',
+            'oauth_key': 'key',
+            'oauth_secret': 'secret',
+            'build_url': None,
+            'spool': None}
+        metadata = offline_metadata(
+            version={'gaia_changeset': 'fake',
+                     'application_repository': 'fake',
+                     'application_changeset': 'fake',
+                     'build_changeset': 'fake'},
+            settings={'deviceinfo.os': 'fake',
+                      'deviceinfo.platform_build_id': 'fake'})
+        poster = DatazillaPerfPoster(None, datazilla_config=datazilla_config,
+                                     log_level=options.log_level,
+                                     metadata=metadata)
+        poster.tracer = tracer
+        for i in range(options.posts):
+            poster.post_to_datazilla(results, options.app_name)
+        poster.close()
+    finally:
+        server.close()
+
+
+def cli():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--iterations',
+                      action='store',
+                      type='int',
+                      dest='iterations',
+                      default=100,
+                      metavar='int',
+                      help='number of launches to time (default: %default)')
+    parser.add_option('--posts',
+                      action='store',
+                      type='int',
+                      dest='posts',
+                      default=10,
+                      metavar='int',
+                      help='number of DataZilla submissions to time '
+                           '(default: %default)')
+    parser.add_option('--app-name',
+                      action='store',
+                      dest='app_name',
+                      default='Fake',
+                      metavar='str',
+                      help='name of the app to launch (default: %default)')
+    parser.add_option('--test-type',
+                      action='store',
+                      type='choice',
+                      choices=['launch', 'scroll'],
+                      dest='test_type',
+                      default='launch',
+                      metavar='str',
+                      help='type of test to run (default: %default)')
+    parser.add_option('--launch-mode',
+                      action='store',
+                      type='choice',
+                      choices=['cold', 'warm', 'mixed'],
+                      dest='launch_mode',
+                      default='cold',
+                      metavar='str',
+                      help='launch mode to time (default: %default)')
+    parser.add_option('--milestones',
+                      action='store_true',
+                      dest='milestones',
+                      default=False,
+                      help='return launch milestones')
+    parser.add_option('--memory',
+                      action='store_true',
+                      dest='sample_memory',
+                      default=False,
+                      help='sample the memory of the app')
+    parser.add_option('--fused-launch',
+                      action='store_true',
+                      dest='fused_launch',
+                      default=False,
+                      help='launch and kill the app in a single script')
+    parser.add_option('--load-time',
+                      action='store',
+                      type='float',
+                      dest='load_time',
+                      default=1000,
+                      metavar='float',
+                      help='median synthetic load time in milliseconds '
+                           '(default: %default)')
+    parser.add_option('--spread',
+                      action='store',
+                      type='float',
+                      dest='spread',
+                      default=0.1,
+                      metavar='float',
+                      help='relative spread of synthetic load times '
+                           '(default: %default)')
+    parser.add_option('--distribution',
+                      action='store',
+                      type='choice',
+                      choices=LatencyModel.distributions,
+                      dest='distribution',
+                      default='lognormal',
+                      metavar='str',
+                      help='distribution of synthetic load times, one of %s '
+                           '(default: %%default)' %
+                           ', '.join(LatencyModel.distributions))
+    parser.add_option('--round-trip',
+                      action='store',
+                      type='float',
+                      dest='round_trip',
+                      default=0,
+                      metavar='float',
+                      help='simulated time in milliseconds for each script '
+                           'to return (default: %default)')
+    parser.add_option('--failure-rate',
+                      action='store',
+                      type='float',
+                      dest='failure_rate',
+                      default=0,
+                      metavar='float',
+                      help='fraction of launches that fail '
+                           '(default: %default)')
+    parser.add_option('--error-rate',
+                      action='store',
+                      type='float',
+                      dest='error_rate',
+                      default=0,
+                      metavar='float',
+                      help='fraction of launches that raise an error '
+                           '(default: %default)')
+    parser.add_option('--session-loss-rate',
+                      action='store',
+                      type='float',
+                      dest='session_loss_rate',
+                      default=0,
+                      metavar='float',
+                      help='fraction of launches that lose the Marionette '
+                           'session (default: %default)')
+    parser.add_option('--seed',
+                      action='store',
+                      type='int',
+                      dest='seed',
+                      metavar='int',
+                      help='seed for synthetic results and failures')
+    parser.add_option('--output',
+                      action='store',
+                      dest='output',
+                      metavar='str',
+                      help='path to write the timings to as JSON')
+    parser.add_option('--log-level',
+                      action='store',
+                      dest='log_level',
+                      default='WARNING',
+                      metavar='str',
+                      help='threshold for log output (default: %default)')
+    options, args = parser.parse_args()
+
+    logger = get_logger('B2GPerfBenchmark', options.log_level)
+    tracer = Tracer()
+    try:
+        results = benchmark_test(options, logger, tracer)
+    except B2GPerfError, e:
+        parser.exit(1, 'Benchmark failed: %s\n' % e)
+    benchmark_post(options, results, tracer)
+
+    phases = {}
+    for name, count, total in tracer.breakdown():
+        phases[name] = {'count': count,
+                        'total': total,
+                        'mean': total / count}
+        print '%s: %d calls, %.3fs total, %.2fms average' % (
+            name, count, total, total / count * 1000)
+    # Everything outside of setup is spent on iterations
+    iterations = phases.get('iteration', {}).get('count', 0)
+    overhead = None
+    if iterations:
+        overhead = (phases['run']['total'] - phases['setup']['total']) / \
+            iterations
+        print 'Harness time per iteration: %.2fms' % (overhead * 1000)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'phases': phases,
+                       'per_iteration': overhead,
+                       'options': vars(options)}, f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import math
+
+import numpy
+
+# Metrics where a larger value is an improvement, all others are times or
+# sizes where smaller is better
+HIGHER_IS_BETTER = ('fps',)
+
+
+def higher_is_better(metric):
+    return metric in HIGHER_IS_BETTER or metric.endswith('_fps')
+
+
+def rank_sum_test(current, baseline):
+    """Two sided Mann-Whitney U test using the normal approximation with a
+    correction for ties. Returns the U statistic of the current samples and
+    the p-value."""
+    n1, n2 = len(current), len(baseline)
+    combined = numpy.concatenate([current, baseline])
+    ordered = numpy.sort(combined)
+    # Average rank of each value, so ties share the mean of their ranks
+    left = numpy.searchsorted(ordered, combined, 'left')
+    right = numpy.searchsorted(ordered, combined, 'right')
+    ranks = (left + right + 1) / 2.0
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+
+    unique = numpy.unique(ordered)
+    ties = (numpy.searchsorted(ordered, unique, 'right') -
+            numpy.searchsorted(ordered, unique, 'left')).astype(float)
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * (
+        (n + 1) - (ties ** 3 - ties).sum() / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2.0) / math.sqrt(variance)
+    return u, math.erfc(abs(z) / math.sqrt(2))
+
+
+def bootstrap_interval(current, baseline, resamples=2000, confidence=0.95,
+                       random_state=None):
+    """Bootstrap confidence interval for the relative change in the median
+    from the baseline to the current samples. All resamples are drawn and
+    reduced at once as arrays."""
+    random_state = random_state or numpy.random.RandomState()
+    current_medians = numpy.median(current[random_state.randint(
+        0, len(current), (resamples, len(current)))], axis=1)
+    baseline_medians = numpy.median(baseline[random_state.randint(
+        0, len(baseline), (resamples, len(baseline)))], axis=1)
+    # Medians of zero only happen with degenerate samples
+    baseline_medians[baseline_medians == 0] = numpy.nan
+    changes = current_medians / baseline_medians - 1
+    changes = changes[~numpy.isnan(changes)]
+    if not len(changes):
+        return None
+    tail = (1 - confidence) / 2 * 100
+    return tuple(numpy.percentile(changes, [tail, 100 - tail]))
+
+
+def compare_metric(current, baseline, higher_better=False, alpha=0.05,
+                   threshold=0.0, resamples=2000, confidence=0.95,
+                   random_state=None):
+    current = numpy.asarray(current, dtype=float)
+    baseline = numpy.asarray(baseline, dtype=float)
+    current_median = numpy.median(current)
+    baseline_median = numpy.median(baseline)
+    u, p_value = rank_sum_test(current, baseline)
+    interval = bootstrap_interval(current, baseline, resamples, confidence,
+                                  random_state)
+    change = None
+    if baseline_median:
+        change = float(current_median / baseline_median - 1)
+
+    verdict = 'unchanged'
+    if p_value < alpha and interval and change is not None and \
+            abs(change) >= threshold and (interval[0] > 0 or interval[1] < 0):
+        worse = change < 0 if higher_better else change > 0
+        verdict = 'regressed' if worse else 'improved'
+    return {'verdict': verdict,
+            'current_median': float(current_median),
+            'baseline_median': float(baseline_median),
+            'change': change,
+            'interval': interval and [float(value) for value in interval],
+            'p_value': float(p_value),
+            # Probability that a current sample is larger than a baseline
+            # sample, 0.5 when there is no difference
+            'effect_size': float(u / (len(current) * len(baseline))),
+            'samples': [len(current), len(baseline)]}
+
+
+def compare(results, baseline, alpha=0.05, threshold=0.0, resamples=2000,
+            confidence=0.95, seed=None):
+    """Compares the samples of every app and metric present in both sets of
+    results, which are dicts of sample lists keyed by app and metric.
+    Returns a list of verdicts."""
+    random_state = numpy.random.RandomState(seed)
+    verdicts = []
+    for app_name in sorted(results):
+        for metric in sorted(results[app_name]):
+            current = results[app_name][metric]
+            previous = baseline.get(app_name, {}).get(metric)
+            if not current or not previous:
+                continue
+            verdict = compare_metric(
+                current, previous, higher_is_better(metric), alpha,
+                threshold, resamples, confidence, random_state)
+            verdict.update({'app': app_name, 'metric': metric})
+            verdicts.append(verdict)
+    return verdicts
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,368 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Stand-ins for a Marionette session, a device and a DataZilla server, so
+the harness can be exercised and timed without a phone."""
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+import json
+import math
+import random
+import re
+import threading
+import time
+
+from marionette.errors import MarionetteException
+
+from memory import PROCESS_NAME_LENGTH
+
+# Steps reported by preparedevice.js
+PREPARE_STEPS = ('volume', 'keyboard_ftu', 'screen_timeout', 'unlock',
+                 'kill_all', 'home')
+
+# Fraction of the load time at which each milestone is reached
+MILESTONE_FRACTIONS = {'first_paint_time': 0.6,
+                       'opened_time': 0.8,
+                       'fully_loaded_time': 1.2}
+
+
+class LatencyModel(object):
+    """Draws synthetic durations in milliseconds around a median. The spread
+    is the standard deviation relative to the median for the normal
+    distribution, and of the logarithm for the lognormal one."""
+
+    distributions = ('lognormal', 'normal', 'constant')
+
+    def __init__(self, median=1000, spread=0.1, distribution='lognormal',
+                 random_state=None):
+        if distribution not in self.distributions:
+            raise ValueError('Unknown distribution %s' % distribution)
+        self.median = median
+        self.spread = spread
+        self.distribution = distribution
+        self.random = random_state or random.Random()
+
+    def sample(self):
+        if self.distribution == 'lognormal':
+            value = self.median * math.exp(self.random.gauss(0, self.spread))
+        elif self.distribution == 'normal':
+            value = self.random.gauss(self.median, self.spread * self.median)
+        else:
+            value = self.median
+        return max(int(round(value)), 1)
+
+
+class FakeMarionette(object):
+    """Answers the scripts b2gperf runs with synthetic results.
+
+    Launches return a load time drawn from load_time, cold or warm depending
+    on whether the app is already running in the background. Each script
+    takes round_trip seconds to return. A fraction of launches can be made
+    to report failure (failure_rate), raise an error (error_rate) or lose
+    the session (session_loss_rate). The names of installed apps can be
+    given as apps. Scrolls report scroll_frames frames, with the time between
+    them drawn from frame_time.
+    """
+
+    scroll_frames = 100
+
+    def __init__(self, load_time=None, warm_load_time=None, round_trip=0,
+                 failure_rate=0, error_rate=0, session_loss_rate=0,
+                 seed=None, apps=None, frame_time=None):
+        self.random = random.Random(seed)
+        self.load_time = load_time or LatencyModel(random_state=self.random)
+        self.warm_load_time = warm_load_time or LatencyModel(
+            median=self.load_time.median / 2, spread=self.load_time.spread,
+            distribution=self.load_time.distribution,
+            random_state=self.random)
+        self.frame_time = frame_time or LatencyModel(
+            median=17, spread=0.2, random_state=self.random)
+        self.round_trip = round_trip
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.session_loss_rate = session_loss_rate
+        self.apps = apps or []
+        self.session = None
+        self.running = {}
+        self.displayed = None
+        self.frame = None
+        self.scripts = []
+        self.calls = 0
+
+    def start_session(self):
+        self.session = {'session_id': 'fake'}
+        return self.session
+
+    def delete_session(self):
+        self.check_session()
+        self.session = None
+
+    def wait_for_port(self, timeout=60):
+        return True
+
+    def check_session(self):
+        if not self.session:
+            raise MarionetteException('Please start a session')
+
+    def set_script_timeout(self, timeout):
+        pass
+
+    def set_search_timeout(self, timeout):
+        pass
+
+    def set_context(self, context):
+        pass
+
+    def switch_to_frame(self, frame=None):
+        self.frame = frame
+
+    def import_script(self, path):
+        self.scripts.append(path)
+
+    def execute_script(self, script, script_args=None, special_powers=False):
+        self.check_session()
+        self.calls += 1
+        time.sleep(self.round_trip)
+        if script == 'return true;':
+            return True
+        if 'GaiaApps.getDisplayedApp()' in script:
+            return {'origin': self.displayed}
+        if 'mozWifiManager' in script:
+            return '00:00:00:00:00:00'
+        if '"home"' in script:
+            self.displayed = None
+        return None
+
+    def execute_async_script(self, script, script_args=None,
+                             special_powers=False):
+        self.check_session()
+        self.calls += 1
+        time.sleep(self.round_trip)
+        match = re.match(
+            r'(launch|launchAndKill)\("(.+)", (true|false), (.+)\)$', script)
+        if match:
+            result = self.launch(match.group(2), match.group(3) == 'true')
+            if result and match.group(1) == 'launchAndKill':
+                del result['frame']
+                self.running.pop(result['origin'], None)
+                self.displayed = None
+            return result
+        if script.startswith('scroll('):
+            if self.frame is None or self.frame != self.displayed:
+                # Hidden apps do not paint
+                return False
+            frame_times = [self.frame_time.sample()
+                           for i in range(self.scroll_frames)]
+            return {'frame_times': frame_times,
+                    'distance': 10000,
+                    'paint_count': len(frame_times)}
+        if 'mozApps.mgmt.getAll()' in script:
+            return [{'origin': self.origin(name),
+                     'manifestURL': '%s/manifest.webapp' % self.origin(name),
+                     'name': name,
+                     'launch_path': '/index.html',
+                     'locales': {}} for name in self.apps]
+        if script.startswith('prepareDevice('):
+            self.running.clear()
+            self.displayed = None
+            return dict((step, True) for step in PREPARE_STEPS)
+        match = re.match(r'background\("(.+)"\)', script)
+        if match:
+            self.displayed = None
+            return True
+        match = re.match(r"GaiaApps\.kill\('(.+)'\)", script)
+        if match:
+            self.running.pop(match.group(1), None)
+            if self.displayed == match.group(1):
+                self.displayed = None
+            return True
+        if script.startswith('GaiaApps.killAll('):
+            self.running.clear()
+            self.displayed = None
+        return True
+
+    def origin(self, app_name):
+        return 'app://%s.gaiamobile.org' % app_name.lower().replace(' ', '')
+
+    def launch(self, app_name, milestones):
+        origin = self.origin(app_name)
+        if self.displayed == origin:
+            return False
+        roll = self.random.random()
+        if roll < self.session_loss_rate:
+            self.session = None
+            raise IOError('Injected loss of session launching %s' % app_name)
+        roll -= self.session_loss_rate
+        if roll < self.error_rate:
+            raise MarionetteException('Injected error launching %s' %
+                                      app_name)
+        if roll < self.error_rate + self.failure_rate:
+            return False
+
+        # The origin stands in for the app's frame element
+        result = {'name': app_name, 'origin': origin, 'frame': origin,
+                  'src': '%s/index.html' % origin}
+        if origin in self.running:
+            result['warm_load_time'] = self.warm_load_time.sample()
+        else:
+            load_time = self.load_time.sample()
+            result['cold_load_time'] = load_time
+            if milestones:
+                for name, fraction in MILESTONE_FRACTIONS.iteritems():
+                    result[name] = int(load_time * fraction)
+            self.running[origin] = app_name
+        self.displayed = origin
+        return result
+
+
+class FakeDeviceManager(object):
+    """Device manager that keeps no files and reports an idle device with
+    the apps started through a FakeMarionette running."""
+
+    build_id = '20140101000000'
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.polls = 0
+
+    def shellCheckOutput(self, cmd, **kwargs):
+        if cmd[0] == 'b2g-info':
+            return self.b2g_info()
+        if cmd[0] == 'cat':
+            return self.proc(cmd[1:])
+        return ''
+
+    def b2g_info(self):
+        lines = ['                          |     megabytes     |',
+                 'NAME      PID PPID CPU(s) NICE  USS  PSS  RSS VSIZE '
+                 'OOM_ADJ USER',
+                 'b2g       100    1   10.0    0 50.0 55.0 70.0 200.0 '
+                 '0 root']
+        for i, name in enumerate(sorted(self.marionette.running.values())):
+            lines.append('%s %d 100 1.0 18 %.1f %.1f %.1f 100.0 2 app_%d' % (
+                name[:PROCESS_NAME_LENGTH], 200 + i, 12.0 + i, 15.0 + i,
+                30.0 + i, 200 + i))
+        return '\n'.join(lines + [''])
+
+    def proc(self, files):
+        self.polls += 1
+        lines = []
+        for path in files:
+            if path == '/proc/stat':
+                lines.append('cpu  %d 0 0 %d 0 0 0 0 0 0' % (
+                    self.polls, self.polls * 100))
+            elif path == '/proc/loadavg':
+                lines.append('0.10 0.20 0.30 1/100 1000')
+            elif path == '/proc/vmstat':
+                lines.extend(['pgpgin 0', 'pgpgout 0'])
+            elif path.startswith('/proc/') and path.endswith('/stat'):
+                lines.append('%s (b2g) S 1 1 0 0 -1 0 0 0 0 0 0 0 0 0' %
+                             path.split('/')[2])
+            elif path.endswith('application.ini'):
+                lines.append('BuildID=%s' % self.build_id)
+        return '\n'.join(lines)
+
+    def processExist(self, name):
+        return 100 if name == 'b2g' else None
+
+    def fileExists(self, path):
+        return False
+
+    def dirExists(self, path):
+        return False
+
+    def mkDirs(self, filename):
+        pass
+
+    def pushFile(self, local, remote):
+        pass
+
+    def pushDir(self, local, remote):
+        pass
+
+    def pullFile(self, remote):
+        return ''
+
+    def getDirectory(self, remote, local):
+        pass
+
+    def forward(self, local, remote):
+        pass
+
+
+class FakeFileManager(object):
+
+    def remove(self, path):
+        pass
+
+    def dir_exists(self, path):
+        return False
+
+    def list_items(self, path):
+        return []
+
+
+class FakeGaiaDevice(object):
+    """Provides the parts of GaiaDevice that tests use."""
+
+    is_online = True
+    has_wifi = True
+    has_mobile_connection = False
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.manager = FakeDeviceManager(marionette)
+        self.file_manager = FakeFileManager()
+
+    def stop_b2g(self):
+        self.marionette.running.clear()
+        self.marionette.displayed = None
+
+    def start_b2g(self, timeout=60):
+        # GaiaDevice starts a new session once B2G is running
+        self.marionette.start_session()
+
+    def unlock(self):
+        pass
+
+
+class FakeDatazillaServer(object):
+    """Accepts DataZilla submissions over HTTP on a local port, responding
+    with status."""
+
+    def __init__(self, response_time=0, status=200):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.getheader('content-length') or 0)
+                server.received.append(self.rfile.read(length))
+                time.sleep(server.response_time)
+                body = json.dumps({'status': 'well-formed JSON stored'})
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.response_time = response_time
+        self.status = status
+        self.received = []
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def host(self):
+        return '%s:%d' % self.httpd.server_address
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
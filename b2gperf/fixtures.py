@@ -0,0 +1,203 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+import pkg_resources
+
+# Locations written to when populating databases while B2G is stopped
+DATABASE_PATHS = ['/data/local/storage/persistent',
+                  '/data/local/indexedDB']
+
+# TODO: Remove hard-coded paths once bug 1018079 is resolved
+STORAGE_PATHS = ['/mnt/sdcard',
+                 '/mnt/extsdcard',
+                 '/storage/sdcard',
+                 '/storage/sdcard0',
+                 '/storage/sdcard1']
+
+# Record of the content populated on the device, keyed by fixture key
+MANIFEST_PATH = '/data/local/tmp/b2gperf_manifest.json'
+
+# Regular file in the output of ls -l from toolbox or toybox, capturing the
+# size and name
+LS_FILE = re.compile(r'^-\S*\s+(?:\d+\s+)?\S+\s+\S+\s+(\d+)\s+'
+                     r'\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}\s+(.+)$')
+
+
+def fixture_key(test_class, fixtures):
+    version = pkg_resources.get_distribution('b2gpopulate').version
+    digest = hashlib.sha1(json.dumps(
+        [test_class.__name__, fixtures, version], sort_keys=True))
+    return '%s-%s' % (test_class.__name__, digest.hexdigest()[:12])
+
+
+def existing_paths(dm, remote_paths):
+    paths = []
+    for remote_path in remote_paths:
+        if not dm.dirExists(remote_path):
+            continue
+        # Storage is often linked under several names, only keep one
+        listing = dm.shellCheckOutput(['ls', '-ld', remote_path])
+        if listing.startswith('l'):
+            continue
+        paths.append(remote_path)
+    return paths
+
+
+def parse_ls_recursive(output):
+    """Returns the path and size of all regular files in the output of
+    ls -lR."""
+    files = set()
+    current = None
+    for line in output.splitlines():
+        line = line.rstrip('\r')
+        if line.startswith('/') and line.endswith(':'):
+            current = line[:-1].rstrip('/')
+            continue
+        match = LS_FILE.match(line)
+        if match and current:
+            files.add(('/'.join([current, match.group(2)]),
+                       int(match.group(1))))
+    return files
+
+
+class FixtureCache(object):
+    """Host side cache of device storage after populating test content.
+
+    Each phase of population is archived separately so databases can be
+    restored while B2G is stopped and files once it has started. Archives
+    are keyed by test class, content counts and b2gpopulate version, so a
+    change to any of them causes the content to be populated again.
+    """
+
+    def __init__(self, path, dm, logger):
+        self.path = path
+        self.dm = dm
+        self.logger = logger
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def archive_path(self, key, phase):
+        return os.path.join(self.path, '%s-%s.tar' % (key, phase))
+
+    def capture(self, key, phase, remote_paths):
+        archive_path = self.archive_path(key, phase)
+        self.logger.debug('Capturing %s fixtures to %s' % (
+            phase, archive_path))
+        temp_dir = tempfile.mkdtemp()
+        # Devices in a pool may capture the same fixtures at once
+        temp_archive = '%s.%d.tmp' % (archive_path, os.getpid())
+        try:
+            tar = tarfile.open(temp_archive, 'w')
+            for remote_path in existing_paths(self.dm, remote_paths):
+                local_path = os.path.join(temp_dir, remote_path.lstrip('/'))
+                self.dm.getDirectory(remote_path, local_path)
+                tar.add(local_path, arcname=remote_path.lstrip('/'))
+            tar.close()
+            os.rename(temp_archive, archive_path)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def restore(self, key, phase, remote_paths):
+        """Push a previously captured phase back to the device. Returns False
+        if there is nothing cached for it."""
+        archive_path = self.archive_path(key, phase)
+        if not os.path.exists(archive_path):
+            return False
+        self.logger.debug('Restoring %s fixtures from %s' % (
+            phase, archive_path))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tar = tarfile.open(archive_path)
+            tar.extractall(temp_dir)
+            tar.close()
+            for remote_path in remote_paths:
+                local_path = os.path.join(temp_dir, remote_path.lstrip('/'))
+                if os.path.isdir(local_path):
+                    # Each location goes over in a single adb push
+                    self.dm.pushDir(local_path, remote_path)
+        finally:
+            shutil.rmtree(temp_dir)
+        return True
+
+    def restore_files(self, key, phase, remote_files):
+        """Push individual files from a previously captured phase. Returns
+        False if the cache does not hold all of them."""
+        archive_path = self.archive_path(key, phase)
+        if not os.path.exists(archive_path):
+            return False
+        tar = tarfile.open(archive_path)
+        try:
+            names = set(tar.getnames())
+            members = [remote_file.lstrip('/') for remote_file in remote_files]
+            if not names.issuperset(members):
+                return False
+            self.logger.debug('Restoring %d %s fixtures from %s' % (
+                len(members), phase, archive_path))
+            temp_dir = tempfile.mkdtemp()
+            try:
+                for member in members:
+                    tar.extract(member, temp_dir)
+                    self.dm.pushFile(os.path.join(temp_dir, member),
+                                     '/' + member)
+            finally:
+                shutil.rmtree(temp_dir)
+        finally:
+            tar.close()
+        return True
+
+
+class ContentManifest(object):
+    """Keeps a list of the files populated for each fixture key on the
+    device, with their sizes, so content that is already present is not
+    pushed again. Files that have the wrong size are treated as missing."""
+
+    def __init__(self, dm, logger, path=MANIFEST_PATH):
+        self.dm = dm
+        self.logger = logger
+        self.path = path
+        self._manifest = None
+
+    def load(self):
+        if self._manifest is None:
+            self._manifest = {}
+            if self.dm.fileExists(self.path):
+                try:
+                    self._manifest = json.loads(self.dm.pullFile(self.path))
+                except ValueError:
+                    self.logger.warn('Ignoring corrupt content manifest')
+        return self._manifest
+
+    def expected(self, key):
+        """Returns the path and size of each file recorded for key."""
+        entries = self.load().get(key, [])
+        if not all(isinstance(entry, list) for entry in entries):
+            # Recorded without sizes, so the files can not be checked
+            return set()
+        return set((path, size) for path, size in entries)
+
+    def record(self, key, remote_files):
+        manifest = self.load()
+        manifest[key] = sorted(remote_files)
+        temp_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        try:
+            json.dump(manifest, temp_file)
+            temp_file.close()
+            self.dm.pushFile(temp_file.name, self.path)
+        finally:
+            os.remove(temp_file.name)
+
+    def list_files(self, remote_paths):
+        files = set()
+        for remote_path in existing_paths(self.dm, remote_paths):
+            files.update(parse_ls_recursive(
+                self.dm.shellCheckOutput(['ls', '-lR', remote_path])))
+        return files
@@ -1,39 +1,168 @@
 "use strict";
 
-function launch(appName) {
-  GaiaApps.locateWithName(appName, function(app, appName, launchPath, entryPoint) {
+// Milestones reported by the app's browser frame, keyed by event type
+var FRAME_MILESTONES = {
+  mozbrowserfirstpaint: 'first_paint_time',
+  mozbrowserloadend: 'fully_loaded_time'
+};
+
+// Events fired by the system app once an app window has opened
+var OPENED_EVENTS = ['appopen', 'appopened', 'appforeground'];
+
+// Maximum time to wait for outstanding milestones after the app has loaded
+var MILESTONE_GRACE = 2000;
+
+function launch(appName, milestones, entry) {
+  launchApp(appName, milestones, entry, marionetteScriptFinished);
+}
+
+// Launch and kill the app in a single script, to save a round trip for
+// each cold launch. Returns once the app is no longer running.
+function launchAndKill(appName, milestones, entry) {
+  launchApp(appName, milestones, entry, function(result) {
+    if (!result) {
+      marionetteScriptFinished(false);
+      return;
+    }
+    // The frame element will not exist once the app has been killed
+    delete result.frame;
+    let origin = result.origin;
+    GaiaApps.kill(origin, function() {
+      waitFor(
+        function() {
+          marionetteScriptFinished(result);
+        },
+        function() {
+          return !GaiaApps.getRunningApps().hasOwnProperty(origin);
+        }
+      );
+    });
+  });
+}
+
+// Find the app from an entry in the host's app index, which avoids searching
+// every installed app. Falls back to searching by name without an entry.
+function locateApp(appName, entry, callback) {
+  if (entry) {
+    let apps = window.wrappedJSObject.applications ||
+               window.wrappedJSObject.Applications;
+    let app = apps.getByManifestURL(entry.manifestURL);
+    if (app) {
+      callback(app, entry.name, entry.launchPath, entry.entryPoint);
+      return;
+    }
+  }
+  GaiaApps.locateWithName(appName, callback);
+}
+
+function launchApp(appName, milestones, entry, callback) {
+  locateApp(appName, entry, function(app, appName, launchPath, entryPoint) {
     if (app) {
       let origin = app.origin;
       if (GaiaApps.getDisplayedApp().origin == origin) {
         console.error("app with origin '" + origin + "' is already running");
-        marionetteScriptFinished(false);
+        callback(false);
       }
       else {
-        window.addEventListener('apploadtime', function appLoadTime(aEvent) {
-          window.removeEventListener('apploadtime', appLoadTime);
-          waitFor(
-            function() {
-              let appWindow = GaiaApps.getAppByURL(app.origin + launchPath);
-              let result = {
-                frame: (appWindow.browser) ? appWindow.browser.element : appWindow.frame.firstChild,
-                src: (appWindow.browser) ? appWindow.browser.element.src : appWindow.iframe.src,
-                name: appWindow.name,
-                origin: appWindow.origin
-              };
-              let loadType = (aEvent.detail.type === 'w') ? 'warm' : 'cold';
-              result[loadType + '_load_time'] = aEvent.detail.time;
-              marionetteScriptFinished(result);
-            },
-            function() {
-              return GaiaApps.getDisplayedApp().src == (origin + launchPath);
+        let start = Date.now();
+        let result = null;
+        let finished = false;
+        let graceTimer = null;
+        let times = {};
+        let expected = Object.keys(FRAME_MILESTONES).length + 1;
+        let waitForMilestones = false;
+        let coldLaunch = false;
+
+        let onFrameEvent = function(aEvent) {
+          let src = aEvent.target.src || '';
+          let name = FRAME_MILESTONES[aEvent.type];
+          if (src.indexOf(origin) === 0 && !(name in times)) {
+            times[name] = Date.now() - start;
+            complete();
+          }
+        };
+
+        let onOpened = function(aEvent) {
+          let detail = aEvent.detail || {};
+          if (detail.origin == origin && !('opened_time' in times)) {
+            times.opened_time = Date.now() - start;
+          }
+          complete();
+        };
+
+        let onLoadTime = function(aEvent) {
+          window.removeEventListener('apploadtime', onLoadTime);
+          let appWindow = GaiaApps.getAppByURL(origin + launchPath);
+          result = {
+            frame: (appWindow.browser) ? appWindow.browser.element : appWindow.frame.firstChild,
+            src: (appWindow.browser) ? appWindow.browser.element.src : appWindow.iframe.src,
+            name: appWindow.name,
+            origin: appWindow.origin
+          };
+          let loadType = (aEvent.detail.type === 'w') ? 'warm' : 'cold';
+          result[loadType + '_load_time'] = aEvent.detail.time;
+          // Milestones only describe launches that load the app from scratch
+          coldLaunch = loadType == 'cold';
+          waitForMilestones = milestones && coldLaunch;
+          complete();
+        };
+
+        let complete = function() {
+          if (finished || !result ||
+              GaiaApps.getDisplayedApp().src != (origin + launchPath)) {
+            return;
+          }
+          if (waitForMilestones && Object.keys(times).length < expected) {
+            if (!graceTimer) {
+              graceTimer = setTimeout(function() {
+                waitForMilestones = false;
+                complete();
+              }, MILESTONE_GRACE);
+            }
+            return;
+          }
+          finished = true;
+          clearTimeout(graceTimer);
+          window.removeEventListener('apploadtime', onLoadTime);
+          OPENED_EVENTS.forEach(function(aType) {
+            window.removeEventListener(aType, onOpened);
+          });
+          Object.keys(FRAME_MILESTONES).forEach(function(aType) {
+            window.removeEventListener(aType, onFrameEvent, true);
+          });
+          if (milestones && coldLaunch) {
+            for (let name in times) {
+              result[name] = times[name];
             }
-          );
+          }
+          callback(result);
+        };
+
+        window.addEventListener('apploadtime', onLoadTime);
+        OPENED_EVENTS.forEach(function(aType) {
+          window.addEventListener(aType, onOpened);
+        });
+        // Browser events do not bubble, so listen for them while capturing
+        Object.keys(FRAME_MILESTONES).forEach(function(aType) {
+          window.addEventListener(aType, onFrameEvent, true);
         });
         console.log("launching app with name '" + appName + "'");
         app.launch(entryPoint || null);
       }
     } else {
-      marionetteScriptFinished(false);
+      callback(false);
     }
   });
 }
+
+function background(origin) {
+  window.wrappedJSObject.dispatchEvent(new Event('home'));
+  waitFor(
+    function() {
+      marionetteScriptFinished(true);
+    },
+    function() {
+      return GaiaApps.getDisplayedApp().origin != origin;
+    }
+  );
+}
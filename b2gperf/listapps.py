@@ -3,28 +3,89 @@
 # This script will list all installed apps in a B2G instance.
 # App names can be passed to b2gperf.py.
 #
+import re
 import sys, os
 from marionette import Marionette
 
-def listapps():
-    marionette = Marionette(host='localhost', port=2828)
-    marionette.start_session()
-    marionette.set_context(marionette.CONTEXT_CONTENT)
-    marionette.set_script_timeout(1000)
-    apps = marionette.execute_async_script("""
+GET_ALL_SCRIPT = """
   let req = navigator.mozApps.mgmt.getAll();
   req.onsuccess = function() {
     let apps = req.result;
     let l = []
     for (let a of apps) {
-      let data = {origin: a.origin, name: a.manifest.name};
+      let data = {origin: a.origin, manifestURL: a.manifestURL,
+                  name: a.manifest.name,
+                  launch_path: a.manifest.launch_path || '',
+                  locales: a.manifest.locales || {}};
       if (a.manifest.entry_points)
         data.entry_points = a.manifest.entry_points;
       l.push(data);
     }
     marionetteScriptFinished(l);
   };
-""")
+"""
+
+# App indexes built in this process, keyed by device serial and build ID
+_app_indexes = {}
+
+
+def normalize_name(name):
+    # Matches GaiaApps.normalizeName
+    return re.sub(r'[- ]+', '', name).lower()
+
+
+def get_apps(marionette):
+    return marionette.execute_async_script(GET_ALL_SCRIPT)
+
+
+class AppIndex(object):
+    """Installed apps keyed by their normalized name, with the origin,
+    manifest URL, launch path and entry point needed to launch them. Names
+    are resolved in the same way as GaiaApps.locateWithName, with localized
+    names only used when no app has a matching name."""
+
+    def __init__(self, apps):
+        self.entries = {}
+        localized = []
+        for app in apps:
+            entry_points = app.get('entry_points') or {None: app}
+            for entry_point, manifest in entry_points.iteritems():
+                entry = {'name': manifest.get('name'),
+                         'origin': app['origin'],
+                         'manifestURL': app['manifestURL'],
+                         'entryPoint': entry_point,
+                         'launchPath': manifest.get('launch_path') or ''}
+                if entry['name']:
+                    self.entries.setdefault(
+                        normalize_name(entry['name']), entry)
+                for locale in (manifest.get('locales') or {}).values():
+                    if locale and locale.get('name'):
+                        localized.append((locale['name'], entry))
+        for name, entry in localized:
+            self.entries.setdefault(normalize_name(name), entry)
+
+    def lookup(self, name):
+        return self.entries.get(normalize_name(name))
+
+
+def get_app_index(marionette, device_serial=None, build_id=None):
+    """Returns the index of installed apps, which is only fetched from the
+    device once for each build."""
+    key = (device_serial, build_id)
+    if build_id and key in _app_indexes:
+        return _app_indexes[key]
+    index = AppIndex(get_apps(marionette))
+    if build_id:
+        _app_indexes[key] = index
+    return index
+
+
+def listapps():
+    marionette = Marionette(host='localhost', port=2828)
+    marionette.start_session()
+    marionette.set_context(marionette.CONTEXT_CONTENT)
+    marionette.set_script_timeout(1000)
+    apps = get_apps(marionette)
     for a in apps:
         print a["name"]
 
@@ -0,0 +1,107 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import posixpath
+import shutil
+import tempfile
+
+import pkg_resources
+
+# Source file b2gpopulate tags a copy of for each track
+MUSIC_SOURCE = 'MUS_0001.mp3'
+
+# Source file and destination of each kind of copied media, as used by
+# b2gpopulate
+MEDIA_FILES = {
+    'pictures': ('picture', 'IMG_0001.jpg', 'DCIM/100MZLLA'),
+    'videos': ('video', 'VID_0001.3gp', 'DCIM/100MZLLA')}
+
+
+def indexed_filename(filename, index):
+    base, _, extension = filename.rpartition('.')
+    return '%s_%d.%s' % (base, index, extension)
+
+
+def stage_music(source, count, path, tracks_per_album=10):
+    """Fills path with numbered copies of source, tagged as albums of
+    tracks in the same way as b2gpopulate."""
+    from mutagen.easyid3 import EasyID3
+    filename = os.path.basename(source)
+    for i in range(1, count + 1):
+        album = (i - 1) / tracks_per_album + 1
+        track = i - (album - 1) * tracks_per_album
+        target = os.path.join(path, indexed_filename(filename, i))
+        shutil.copyfile(source, target)
+        mp3 = EasyID3(target)
+        mp3['title'] = 'Track %d' % track
+        mp3['artist'] = 'Artist %d' % album
+        mp3['album'] = 'Album %d' % album
+        mp3['tracknumber'] = str(track)
+        mp3.save()
+
+
+def duplicate_script(remote_file, count):
+    """Shell script that replaces remote_file with count numbered copies,
+    named as GaiaFileManager.duplicate_file names them. Files are copied
+    with dd, as DeviceManagerADB.copyTree does, because toolbox has no
+    cp."""
+    base, _, extension = remote_file.rpartition('.')
+    return ('i=1; while [ $i -le %(count)d ]; do '
+            'dd if=%(source)s of=%(base)s_$i.%(extension)s 2>/dev/null '
+            '|| exit 1; i=$((i+1)); done; rm %(source)s' % {
+                'count': count,
+                'source': remote_file,
+                'base': base,
+                'extension': extension})
+
+
+class MediaPopulator(object):
+    """Populates media in a handful of device transactions. b2gpopulate
+    pushes and tags each music track separately, and copies pictures and
+    videos on the device with one adb command per copy. Here music is
+    tagged on the host and pushed with a single pushDir, and pictures and
+    videos are pushed once and copied by a single shell script."""
+
+    def __init__(self, b2gpopulate, dm, logger):
+        self.b2gpopulate = b2gpopulate
+        self.dm = dm
+        self.logger = logger
+
+    def populate(self, fixture, count):
+        if fixture == 'music':
+            self.populate_music(count)
+        else:
+            self.populate_files(fixture, count)
+
+    def populate_music(self, count):
+        self.b2gpopulate.remove_media('music')
+        source_file = pkg_resources.resource_filename(
+            'b2gpopulate', '/'.join(['resources', MUSIC_SOURCE]))
+
+        self.logger.info('Populating %d music files' % count)
+        stage = tempfile.mkdtemp()
+        try:
+            stage_music(source_file, count, stage)
+            self.logger.debug('Pushing %d tagged music files to %s' % (
+                count, self.dm.deviceRoot))
+            self.dm.pushDir(stage, self.dm.deviceRoot)
+        finally:
+            shutil.rmtree(stage)
+
+    def populate_files(self, fixture, count):
+        file_type, source, destination = MEDIA_FILES[fixture]
+        self.b2gpopulate.remove_media(file_type)
+        source_file = pkg_resources.resource_filename(
+            'b2gpopulate', '/'.join(['resources', source]))
+        remote_path = posixpath.join(self.dm.deviceRoot, destination)
+        remote_file = posixpath.join(remote_path, source)
+
+        self.logger.info('Populating %d %s files' % (count, file_type))
+        self.dm.mkDirs(remote_file)
+        self.dm.pushFile(source_file, remote_file)
+        self.logger.debug('Copying %s %d times on the device' % (
+            remote_file, count))
+        self.dm.shellCheckOutput(['sh', '-c',
+                                  duplicate_script(remote_file, count)])
@@ -0,0 +1,65 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Memory metrics reported for launched apps, in megabytes
+MEMORY_METRICS = ('uss', 'pss', 'rss')
+
+# Process names are truncated to this length by the kernel
+PROCESS_NAME_LENGTH = 15
+
+
+def parse_b2g_info(output):
+    """Returns a dict for each process in the output of b2g-info, with the
+    lower cased column names as keys. Numeric columns are converted to
+    floats."""
+    processes = []
+    columns = None
+    for line in output.splitlines():
+        fields = line.split()
+        if columns is None:
+            if fields[:2] == ['NAME', 'PID']:
+                columns = [field.lower() for field in fields]
+            continue
+        if not fields:
+            # The process table ends with a blank line
+            break
+        count = len(columns) - 1
+        if len(fields) <= count:
+            continue
+        # Names may contain spaces, so take the other columns from the end
+        process = {'name': ' '.join(fields[:-count])}
+        for column, value in zip(columns[1:], fields[-count:]):
+            try:
+                process[column] = float(value)
+            except ValueError:
+                process[column] = value
+        processes.append(process)
+    return processes
+
+
+def find_process(processes, name):
+    truncated = name[:PROCESS_NAME_LENGTH]
+    for process in processes:
+        if process['name'] in (name, truncated):
+            return process
+    return None
+
+
+class MemorySampler(object):
+    """Reads the memory use of an app's process with b2g-info."""
+
+    def __init__(self, dm, logger):
+        self.dm = dm
+        self.logger = logger
+
+    def sample(self, name):
+        """Returns the memory metrics of the named process, or None if it
+        is not running."""
+        processes = parse_b2g_info(self.dm.shellCheckOutput(['b2g-info']))
+        process = find_process(processes, name)
+        if not process:
+            self.logger.warn("Unable to find process for '%s'" % name)
+            return None
+        return dict((metric, process[metric]) for metric in MEMORY_METRICS
+                    if metric in process)
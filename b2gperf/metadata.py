@@ -0,0 +1,147 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import os
+from xml.etree import ElementTree
+
+APPLICATION_INI = '/system/b2g/application.ini'
+
+# Gaia packages that change whenever gaia is flashed, which can be done
+# without changing the Gecko build
+GAIA_PACKAGES = ('/system/b2g/webapps/settings.gaiamobile.org/application.zip',
+                 '/data/local/webapps/settings.gaiamobile.org/application.zip')
+
+# Fields of mozversion output used in reports
+VERSION_FIELDS = ('build_changeset',
+                  'gaia_changeset',
+                  'application_repository',
+                  'application_changeset',
+                  'device_firmware_version_incremental',
+                  'device_firmware_version_release',
+                  'device_firmware_date')
+
+# Device settings used in reports
+SETTINGS_FIELDS = ('deviceinfo.os',
+                   'deviceinfo.platform_build_id')
+
+# Projects in sources.xml and the version fields their revisions belong to
+SOURCES_PROJECTS = {'gaia': 'gaia',
+                    'gecko': 'application',
+                    'build': 'build'}
+
+
+def get_build_id(dm):
+    """Returns the Gecko build ID of the device, or None if it could not be
+    determined."""
+    output = dm.shellCheckOutput(['cat', APPLICATION_INI])
+    for line in output.splitlines():
+        key, _, value = line.strip().partition('=')
+        if key == 'BuildID' and value:
+            return value
+    return None
+
+
+def get_gaia_id(dm):
+    """Returns an identifier that changes whenever gaia is flashed, taken
+    from the size and modification time of its packages, or None if they
+    could not be found."""
+    listings = [dm.shellCheckOutput(['ls', '-l', path])
+                for path in GAIA_PACKAGES if dm.fileExists(path)]
+    if not listings:
+        return None
+    return hashlib.sha1('\n'.join(listings)).hexdigest()[:12]
+
+
+def empty_metadata():
+    return {'version': dict((key, None) for key in VERSION_FIELDS),
+            'settings': dict((key, None) for key in SETTINGS_FIELDS),
+            'mac_address': None}
+
+
+def parse_sources(sources):
+    """Returns the revisions and repositories of the gaia, gecko and build
+    projects in a repo manifest, keyed by the version fields they fill."""
+    root = ElementTree.parse(sources).getroot()
+    remotes = dict((remote.get('name'), remote.get('fetch'))
+                   for remote in root.findall('remote'))
+    default = root.find('default')
+    default_remote = default is not None and default.get('remote')
+    version = {}
+    for project in root.findall('project'):
+        prefix = SOURCES_PROJECTS.get(project.get('path'))
+        if not prefix:
+            continue
+        version['%s_changeset' % prefix] = project.get('revision')
+        fetch = remotes.get(project.get('remote') or default_remote)
+        if fetch and project.get('name'):
+            version['%s_repository' % prefix] = '/'.join(
+                [fetch.rstrip('/'), project.get('name')])
+    return dict((key, value) for key, value in version.iteritems()
+                if key in VERSION_FIELDS)
+
+
+def offline_metadata(path=None, sources=None, version=None, settings=None,
+                     mac_address=None):
+    """Builds metadata without a device. Values are taken from a JSON file
+    with the same layout as the metadata cache, then the sources.xml, then
+    the given fields, with later sources taking precedence."""
+    metadata = empty_metadata()
+    if path:
+        with open(path) as f:
+            loaded = json.load(f)
+        metadata['version'].update(loaded.get('version', {}))
+        metadata['settings'].update(loaded.get('settings', {}))
+        metadata['mac_address'] = loaded.get('mac_address')
+    if sources:
+        metadata['version'].update(parse_sources(sources))
+    for key, value in (version or {}).iteritems():
+        if value:
+            metadata['version'][key] = value
+    for key, value in (settings or {}).iteritems():
+        if value:
+            metadata['settings'][key] = value
+    metadata['mac_address'] = mac_address or metadata['mac_address']
+    return metadata
+
+
+class MetadataCache(object):
+    """Stores device and build details on the host, keyed by device serial,
+    build ID and gaia packages, so they only need to be queried once per
+    flash."""
+
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def cache_path(self, device_serial, build_id, sources=None,
+                   gaia_id=None):
+        name = '%s-%s' % (device_serial or 'default', build_id)
+        if gaia_id:
+            name += '-%s' % gaia_id
+        if sources:
+            # Revisions come from the sources file when one is given
+            with open(sources) as f:
+                name += '-%s' % hashlib.sha1(f.read()).hexdigest()[:12]
+        return os.path.join(self.path, '%s.json' % name)
+
+    def get(self, device_serial, build_id, sources=None, gaia_id=None):
+        path = self.cache_path(device_serial, build_id, sources, gaia_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            self.logger.warn('Ignoring corrupt metadata cache %s' % path)
+            return None
+
+    def put(self, device_serial, build_id, metadata, sources=None,
+            gaia_id=None):
+        path = self.cache_path(device_serial, build_id, sources, gaia_id)
+        with open(path, 'w') as f:
+            json.dump(metadata, f)
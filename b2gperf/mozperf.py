@@ -2,63 +2,189 @@
 #
 
 import json
+import multiprocessing
+import os
 
 from b2gperf import dzOptionParser, DatazillaPerfPoster, B2GPerfError
 from marionette import Marionette
+from metadata import offline_metadata
 
 
-class MozPerfHandler(DatazillaPerfPoster):
+def iter_json_array(f, chunk_size=65536):
+    """Yields each element of the JSON array in a file without loading the
+    whole file into memory."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    started = False
+    eof = False
+    while True:
+        buf = buf.lstrip()
+        if not started:
+            if buf.startswith('['):
+                buf = buf[1:]
+                started = True
+                continue
+        elif buf.startswith(','):
+            buf = buf[1:]
+            continue
+        elif buf.startswith(']'):
+            return
+        elif buf:
+            try:
+                element, end = decoder.raw_decode(buf)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the
+                # next chunk
+                if buf[end:].strip() or eof:
+                    yield element
+                    buf = buf[end:]
+                    continue
+        elif eof:
+            raise ValueError('Unexpected end of JSON array')
+        if eof and not started:
+            raise ValueError('Expected a JSON array')
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        # Grow reads with the buffer so large elements are not parsed from
+        # the start too many times
+        chunk_size = max(chunk_size, len(buf))
+        buf += chunk
+
+
+def collect_app_results(app_results):
+    """Returns the name of an app and its results keyed by suite, or None
+    if it has no passing results."""
+    app_name = app_results.get('stats', {}).get('application')
+    if not len(app_results.get('passes', ())):
+        print "no passing results for %s, skipping" % app_name
+        return None
+
+    app_memory = '%s_memory' % app_name
+    results = {'durations': {},
+               'uss': {app_memory: []},
+               'pss': {app_memory: []},
+               'rss': {app_memory: []},
+               'vsize': {app_memory: []},
+               'system_uss': {app_memory: []},
+               'system_pss': {app_memory: []},
+               'system_rss': {app_memory: []},
+               'system_vsize': {app_memory: []}}
+
+    for result in app_results.get('passes'):
+        metric = result['title'].strip().replace(' ', '_')
+        results['durations'].setdefault(metric, []).extend(
+            result.get('mozPerfDurations'))
+        for perfmemory in result.setdefault('mozPerfMemory', []):
+            if perfmemory.get('app'):
+                for memory_metric in ('uss', 'pss', 'rss', 'vsize'):
+                    if perfmemory['app'].get(memory_metric):
+                        results[memory_metric][app_memory].append(
+                            perfmemory['app'][memory_metric])
+            if perfmemory.get('system'):
+                for memory_metric in ('uss', 'pss', 'rss', 'vsize'):
+                    if perfmemory['system'].get(memory_metric):
+                        metric = results['system_%s' % memory_metric]
+                        metric[app_memory].append(
+                            perfmemory['system'][memory_metric])
+    return app_name, results
+
+
+def merge_app_results(merged, app_name, results):
+    app = merged.setdefault(app_name, {})
+    for suite, metrics in results.iteritems():
+        for metric, values in metrics.iteritems():
+            app.setdefault(suite, {}).setdefault(metric, []).extend(values)
 
-    def process_results(self, filename):
-        with open(filename, 'r') as f:
-            raw_results = json.loads(f.read())
 
+def parse_results_file(filename, stream=False):
+    """Returns the results of each app in a result file, merged by app."""
+    merged = {}
+    with open(filename, 'r') as f:
+        if stream:
+            raw_results = iter_json_array(f)
+        else:
+            raw_results = json.loads(f.read())
         for app_results in raw_results:
-            app_name = app_results.get('stats', {}).get('application')
-            if not len(app_results.get('passes', ())):
-                print "no passing results for %s, skipping" % app_name
-                continue
+            collected = collect_app_results(app_results)
+            if collected:
+                merge_app_results(merged, *collected)
+    return merged
+
+
+def _parse_results_file(args):
+    # Pool.imap only passes a single argument
+    return parse_results_file(*args)
+
+
+def find_result_files(paths):
+    """Expands directories to the JSON files they contain."""
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            filenames.extend(os.path.join(root, name) for name in
+                             sorted(files) if name.endswith('.json'))
+    return filenames
 
-            app_memory = '%s_memory' % app_name
-            results = {'durations': {},
-                       'uss': {app_memory: []},
-                       'pss': {app_memory: []},
-                       'rss': {app_memory: []},
-                       'vsize': {app_memory: []},
-                       'system_uss': {app_memory: []},
-                       'system_pss': {app_memory: []},
-                       'system_rss': {app_memory: []},
-                       'system_vsize': {app_memory: []}}
-
-            for result in app_results.get('passes'):
-                metric = result['title'].strip().replace(' ', '_')
-                results['durations'].setdefault(metric, []).extend(
-                    result.get('mozPerfDurations'))
-                for perfmemory in result.setdefault('mozPerfMemory', []):
-                    if perfmemory.get('app'):
-                        for memory_metric in ('uss', 'pss', 'rss', 'vsize'):
-                            if perfmemory['app'].get(memory_metric):
-                                results[memory_metric][app_memory].append(
-                                    perfmemory['app'][memory_metric])
-                    if perfmemory.get('system'):
-                        for memory_metric in ('uss', 'pss', 'rss', 'vsize'):
-                            if perfmemory['system'].get(memory_metric):
-                                metric = results['system_%s' % memory_metric]
-                                metric[app_memory].append(
-                                    perfmemory['system'][memory_metric])
-
-            if self.submit_report:
-                for item in results:
-                    name = app_name if item == 'durations' else item
-                    self.post_to_datazilla(results[item], name)
+
+class MozPerfHandler(DatazillaPerfPoster):
+
+    def process_results(self, filename, stream=False):
+        with open(filename, 'r') as f:
+            if stream:
+                # Handle one app at a time so only its results are in memory
+                for app_results in iter_json_array(f):
+                    self.process_app_results(app_results)
             else:
-                print 'results for %s' % app_name
-                for item in results:
-                    print item, json.dumps(results[item])
+                for app_results in json.loads(f.read()):
+                    self.process_app_results(app_results)
+
+    def process_files(self, filenames, stream=False, processes=None):
+        """Parses result files in parallel and submits the results of each
+        app once they have been merged across all of the files."""
+        if len(filenames) == 1:
+            return self.process_results(filenames[0], stream=stream)
+
+        merged = {}
+        pool = multiprocessing.Pool(processes)
+        try:
+            for file_results in pool.imap(
+                    _parse_results_file,
+                    [(filename, stream) for filename in filenames]):
+                for app_name, results in file_results.iteritems():
+                    merge_app_results(merged, app_name, results)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for app_name in sorted(merged):
+            self.submit_app_results(app_name, merged[app_name])
+
+    def process_app_results(self, app_results):
+        collected = collect_app_results(app_results)
+        if collected:
+            self.submit_app_results(*collected)
+
+    def submit_app_results(self, app_name, results):
+        if self.submit_report:
+            for item in results:
+                name = app_name if item == 'durations' else item
+                self.post_to_datazilla(results[item], name)
+        else:
+            print 'results for %s' % app_name
+            for item in results:
+                print item, json.dumps(results[item])
 
 
 def cli():
-    parser = dzOptionParser(usage='%prog [options] result_file')
+    parser = dzOptionParser(usage='%prog [options] result_file|directory ...')
     parser.add_option('--address',
                       action='store',
                       dest='address',
@@ -70,29 +196,106 @@ def cli():
                       dest='device_serial',
                       metavar='str',
                       help='serial identifier of device to target')
+    parser.add_option('--stream',
+                      action='store_true',
+                      dest='stream',
+                      default=False,
+                      help='parse and submit the results of one app at a '
+                           'time, for result files too large to load at once')
+    parser.add_option('--processes',
+                      action='store',
+                      type='int',
+                      dest='processes',
+                      metavar='int',
+                      help='number of processes used to parse result files '
+                           '(default: number of CPUs)')
+    parser.add_option('--offline',
+                      action='store_true',
+                      dest='offline',
+                      default=False,
+                      help='submit results without connecting to a device, '
+                           'taking build details from --metadata, --sources '
+                           'and the options below')
+    parser.add_option('--metadata',
+                      action='store',
+                      dest='metadata',
+                      metavar='str',
+                      help='JSON file of build details for --offline, in the '
+                           'format written to --metadata-cache')
+    parser.add_option('--gaia-revision',
+                      action='store',
+                      dest='gaia_revision',
+                      metavar='str',
+                      help='gaia revision for --offline')
+    parser.add_option('--gecko-repository',
+                      action='store',
+                      dest='gecko_repository',
+                      metavar='str',
+                      help='gecko repository for --offline')
+    parser.add_option('--gecko-revision',
+                      action='store',
+                      dest='gecko_revision',
+                      metavar='str',
+                      help='gecko revision for --offline')
+    parser.add_option('--build-revision',
+                      action='store',
+                      dest='build_revision',
+                      metavar='str',
+                      help='build revision for --offline')
+    parser.add_option('--os-version',
+                      action='store',
+                      dest='os_version',
+                      metavar='str',
+                      help='operating system version for --offline')
+    parser.add_option('--build-id',
+                      action='store',
+                      dest='build_id',
+                      metavar='str',
+                      help='platform build id for --offline')
     options, args = parser.parse_args()
 
     if not args:
         parser.print_usage()
         parser.exit()
 
-    if len(args) != 1:
-        parser.exit("You can only specify one result file")
+    filenames = find_result_files(args)
+    if not filenames:
+        parser.exit(1, 'No result files found\n')
 
     datazilla_config = parser.datazilla_config(options)
 
-    try:
-        host, port = options.address.split(':')
-    except ValueError:
-        raise B2GPerfError('--address must be in the format host:port')
+    if options.offline:
+        marionette = None
+        metadata = offline_metadata(
+            path=options.metadata,
+            sources=options.sources,
+            version={'gaia_changeset': options.gaia_revision,
+                     'application_repository': options.gecko_repository,
+                     'application_changeset': options.gecko_revision,
+                     'build_changeset': options.build_revision},
+            settings={'deviceinfo.os': options.os_version,
+                      'deviceinfo.platform_build_id': options.build_id})
+    else:
+        try:
+            host, port = options.address.split(':')
+        except ValueError:
+            raise B2GPerfError('--address must be in the format host:port')
+
+        marionette = Marionette(host=host, port=int(port))
+        marionette.start_session()
+        metadata = None
 
-    marionette = Marionette(host=host, port=int(port))
-    marionette.start_session()
     handler = MozPerfHandler(marionette,
                              datazilla_config=datazilla_config,
                              sources=options.sources,
-                             device_serial=options.device_serial)
-    handler.process_results(args[0])
+                             metadata_cache=options.metadata_cache,
+                             device_serial=options.device_serial,
+                             metadata=metadata)
+    try:
+        handler.process_files(filenames, stream=options.stream,
+                              processes=options.processes)
+    finally:
+        handler.close()
 
 
 if __name__ == '__main__':
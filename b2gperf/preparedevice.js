@@ -0,0 +1,92 @@
+"use strict";
+
+function prepareDevice(aVolume) {
+  let results = {};
+
+  function step(aName, aFunction, aNext) {
+    try {
+      aFunction(function(aResult) {
+        results[aName] = aResult;
+        aNext();
+      });
+    } catch (e) {
+      console.error("unable to complete '" + aName + "': " + e);
+      results[aName] = false;
+      aNext();
+    }
+  }
+
+  function poll(aCondition, aCallback) {
+    let deadline = Date.now() + 10000;
+    (function check() {
+      if (aCondition()) {
+        aCallback(true);
+      } else if (Date.now() > deadline) {
+        aCallback(false);
+      } else {
+        setTimeout(check, 50);
+      }
+    })();
+  }
+
+  function setSetting(aName, aValue) {
+    return function(aCallback) {
+      let setting = {};
+      setting[aName] = aValue;
+      let lock = SpecialPowers.wrap(window.navigator.mozSettings).createLock();
+      let req = lock.set(setting);
+      req.onsuccess = function() { aCallback(true); };
+      req.onerror = function() { aCallback(false); };
+    };
+  }
+
+  function unlock(aCallback) {
+    let lockscreen = window.wrappedJSObject.lockScreen ||
+                     window.wrappedJSObject.LockScreen;
+    window.wrappedJSObject.ScreenManager.turnScreenOn();
+    lockscreen.unlock(true);
+    poll(function() { return !lockscreen.locked; }, aCallback);
+  }
+
+  function killAll(aCallback) {
+    let origins = Object.keys(GaiaApps.getRunningApps()).filter(
+      function(aOrigin) { return !/homescreen|verticalhome/.test(aOrigin); });
+    let remaining = origins.length;
+    if (!remaining) {
+      aCallback(true);
+      return;
+    }
+    origins.forEach(function(aOrigin) {
+      GaiaApps.kill(aOrigin, function() {
+        if (--remaining === 0) {
+          poll(function() {
+            let running = GaiaApps.getRunningApps();
+            return origins.every(function(aOrigin) {
+              return !running.hasOwnProperty(aOrigin);
+            });
+          }, aCallback);
+        }
+      });
+    });
+  }
+
+  function home(aCallback) {
+    window.wrappedJSObject.dispatchEvent(new Event('home'));
+    aCallback(true);
+  }
+
+  step('volume', setSetting('audio.volume.content', aVolume), function() {
+    step('keyboard_ftu', setSetting('keyboard.ftu.enabled', false), function() {
+      // Keep the screen from blanking and locking again during the run
+      step('screen_timeout', setSetting('screen.timeout', 0), function() {
+        step('unlock', unlock, function() {
+          step('kill_all', killAll, function() {
+            step('home', home, function() {
+              marionetteScriptFinished(results);
+            });
+          });
+        });
+      });
+    });
+  });
+}
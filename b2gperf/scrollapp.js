@@ -0,0 +1,97 @@
+"use strict";
+
+// Time to wait for the app to have enough content to scroll
+var SCROLL_TIMEOUT = 10000;
+
+// Interval between checks for content to scroll
+var SCROLL_POLL_INTERVAL = 100;
+
+// Find the element with the given selector, or the element with the most
+// content to scroll
+function findScrollable(selector) {
+  if (selector) {
+    return document.querySelector(selector);
+  }
+  let scrollable = null;
+  let range = 0;
+  let elements = document.querySelectorAll('*');
+  for (let i = 0; i < elements.length; i++) {
+    let element = elements[i];
+    let overflow = window.getComputedStyle(element).overflowY;
+    let elementRange = element.scrollHeight - element.clientHeight;
+    if ((overflow == 'auto' || overflow == 'scroll') && elementRange > range) {
+      scrollable = element;
+      range = elementRange;
+    }
+  }
+  return scrollable;
+}
+
+// Scroll down by step pixels each frame until distance has been scrolled or
+// the end of the content is reached, then back up to the top. Returns the
+// time in milliseconds between each frame, or false if there was nothing to
+// scroll.
+function scroll(selector, step, distance) {
+  let start = Date.now();
+  let poll = function() {
+    let element = findScrollable(selector);
+    // Wait for at least a screen of content to scroll through
+    if (element && element.scrollHeight >= 2 * element.clientHeight) {
+      scrollElement(element, step, distance);
+    }
+    else if (Date.now() - start > SCROLL_TIMEOUT) {
+      console.error('nothing to scroll');
+      marionetteScriptFinished(false);
+    }
+    else {
+      setTimeout(poll, SCROLL_POLL_INTERVAL);
+    }
+  };
+  poll();
+}
+
+function scrollElement(element, step, distance) {
+  let frameTimes = [];
+  let last = null;
+  let direction = 1;
+  let furthest = 0;
+  let paints = window.mozPaintCount;
+  element.scrollTop = 0;
+
+  let finish = function() {
+    marionetteScriptFinished({
+      frame_times: frameTimes,
+      distance: furthest,
+      paint_count: window.mozPaintCount - paints
+    });
+  };
+
+  let onFrame = function() {
+    let now = window.performance.now();
+    if (last !== null) {
+      frameTimes.push(now - last);
+    }
+    last = now;
+
+    let position = element.scrollTop;
+    furthest = Math.max(furthest, position);
+    if (direction > 0 && position >= distance) {
+      direction = -1;
+    }
+    if (direction < 0 && position <= 0) {
+      finish();
+      return;
+    }
+    element.scrollTop = position + direction * step;
+    if (element.scrollTop == position) {
+      // The end of the content was reached before the full distance
+      if (direction < 0) {
+        finish();
+        return;
+      }
+      direction = -1;
+    }
+    window.requestAnimationFrame(onFrame);
+  };
+  window.requestAnimationFrame(onFrame);
+}
@@ -0,0 +1,110 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import socket
+
+from marionette.errors import MarionetteException
+
+# Errors raised by the client when the connection to the device is lost
+CONNECTION_ERRORS = (MarionetteException, socket.error, IOError)
+
+
+class MarionetteSession(object):
+    """Wraps a Marionette client and remembers the timeouts, context and
+    imported scripts of its session.
+
+    Whenever a new session is started, including by GaiaDevice when B2G is
+    restarted, that state is applied to it again. recover() reconnects if
+    the session has died. Everything else is passed through to the client,
+    so a single healthy session is shared by every test.
+    """
+
+    # Attributes of the wrapper itself, any others belong to the client
+    fields = ('marionette', 'logger', 'script_timeout', 'search_timeout',
+              'context', 'scripts')
+
+    def __init__(self, marionette, logger):
+        self.marionette = marionette
+        self.logger = logger
+        self.script_timeout = None
+        self.search_timeout = None
+        self.context = None
+        self.scripts = []
+
+    def __getattr__(self, name):
+        return getattr(self.marionette, name)
+
+    def __setattr__(self, name, value):
+        # GaiaDevice clears the session and window when restarting B2G,
+        # which has to reach the client rather than shadow it
+        if name in self.fields:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.marionette, name, value)
+
+    def set_script_timeout(self, timeout):
+        self.script_timeout = timeout
+        return self.marionette.set_script_timeout(timeout)
+
+    def set_search_timeout(self, timeout):
+        self.search_timeout = timeout
+        return self.marionette.set_search_timeout(timeout)
+
+    def set_context(self, context):
+        self.context = context
+        return self.marionette.set_context(context)
+
+    def import_script(self, path):
+        if path not in self.scripts:
+            self.scripts.append(path)
+        return self.marionette.import_script(path)
+
+    def start_session(self, *args, **kwargs):
+        session = self.marionette.start_session(*args, **kwargs)
+        self.restore()
+        return session
+
+    def restore(self):
+        if self.script_timeout is not None:
+            self.marionette.set_script_timeout(self.script_timeout)
+        if self.search_timeout is not None:
+            self.marionette.set_search_timeout(self.search_timeout)
+        if self.context is not None:
+            self.marionette.set_context(self.context)
+        for path in self.scripts:
+            self.marionette.import_script(path)
+
+    def is_alive(self):
+        if not self.marionette.session:
+            return False
+        try:
+            return self.marionette.execute_script('return true;') is True
+        except CONNECTION_ERRORS:
+            return False
+
+    def recover(self, timeout=60):
+        """Starts a new session if the current one has died. Returns True if
+        it reconnected, and False if the session was healthy or could not be
+        started again."""
+        if self.is_alive():
+            return False
+        self.logger.warn('Marionette session lost, reconnecting')
+        try:
+            self.marionette.delete_session()
+        except CONNECTION_ERRORS:
+            pass
+        self.marionette.session = None
+        client = getattr(self.marionette, 'client', None)
+        if client:
+            client.close()
+        if not self.marionette.wait_for_port(timeout):
+            self.logger.error('Marionette did not come back within %d '
+                              'seconds' % timeout)
+            return False
+        try:
+            self.start_session()
+        except CONNECTION_ERRORS, e:
+            self.logger.error('Unable to start a new session: %s' % e)
+            return False
+        return True
@@ -0,0 +1,98 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+
+def parse_load(output, pid=None):
+    """Extracts cumulative activity counters from the concatenated output of
+    /proc/stat, /proc/loadavg, /proc/vmstat and optionally /proc/<pid>/stat.
+
+    Returns a dict with busy and total CPU ticks for the whole system, CPU
+    ticks for the process, pages paged in and out and the one minute load
+    average.
+    """
+    load = {'cpu_busy': 0, 'cpu_total': 0, 'process_ticks': 0,
+            'paged': 0, 'loadavg': None}
+    process_prefix = pid and '%s (' % pid
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'cpu':
+            ticks = [int(field) for field in fields[1:]]
+            # idle and iowait are the fourth and fifth columns
+            idle = sum(ticks[3:5])
+            load['cpu_total'] = sum(ticks)
+            load['cpu_busy'] = load['cpu_total'] - idle
+        elif fields[0] in ('pgpgin', 'pgpgout'):
+            load['paged'] += int(fields[1])
+        elif process_prefix and line.startswith(process_prefix):
+            # Skip past the command name, which may contain spaces
+            stat = line[line.rindex(')') + 2:].split()
+            # utime and stime are fields 14 and 15 of the full line
+            load['process_ticks'] = int(stat[11]) + int(stat[12])
+        elif len(fields) == 5 and '/' in fields[3]:
+            load['loadavg'] = float(fields[0])
+    return load
+
+
+class QuiescenceMonitor(object):
+    """Waits for the device to become idle.
+
+    The device is polled over adb for CPU and I/O activity, and is
+    considered quiet once system CPU use, CPU use by the B2G process and the
+    paging rate have all stayed under their thresholds for a whole window.
+    """
+
+    def __init__(self, dm, logger, cpu_threshold=0.1, process_threshold=0.05,
+                 paging_threshold=100, interval=1):
+        self.dm = dm
+        self.logger = logger
+        self.cpu_threshold = cpu_threshold
+        self.process_threshold = process_threshold
+        self.paging_threshold = paging_threshold
+        self.interval = interval
+
+    def sample(self, pid):
+        files = ['/proc/stat', '/proc/loadavg', '/proc/vmstat']
+        if pid:
+            files.append('/proc/%s/stat' % pid)
+        output = self.dm.shellCheckOutput(['cat'] + files)
+        return time.time(), parse_load(output, pid)
+
+    def is_quiet(self, previous, current):
+        (then, before), (now, after) = previous, current
+        cpu_total = after['cpu_total'] - before['cpu_total']
+        if cpu_total <= 0:
+            return False
+        cpu = (after['cpu_busy'] - before['cpu_busy']) / float(cpu_total)
+        process = (after['process_ticks'] - before['process_ticks']) / \
+            float(cpu_total)
+        paging = (after['paged'] - before['paged']) / max(now - then, 0.001)
+        self.logger.debug('Device load: cpu %.2f, b2g %.2f, paging %d/s, '
+                          'loadavg %s' % (cpu, process, paging,
+                                          after['loadavg']))
+        return cpu < self.cpu_threshold and \
+            process < self.process_threshold and \
+            paging < self.paging_threshold
+
+    def wait(self, quiet_window, timeout):
+        """Returns the number of seconds waited, which is at most timeout."""
+        start = time.time()
+        pid = self.dm.processExist('b2g')
+        previous = self.sample(pid)
+        quiet_since = None
+        while time.time() - start < timeout:
+            time.sleep(min(self.interval,
+                           max(timeout - (time.time() - start), 0)))
+            current = self.sample(pid)
+            if self.is_quiet(previous, current):
+                quiet_since = quiet_since or previous[0]
+                if current[0] - quiet_since >= quiet_window:
+                    break
+            else:
+                quiet_since = None
+            previous = current
+        return min(time.time() - start, timeout)
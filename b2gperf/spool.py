@@ -0,0 +1,194 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import threading
+import time
+import uuid
+
+import dzclient
+
+# Request fields that are never written to the spool
+CREDENTIAL_FIELDS = ('oauth_key', 'oauth_secret')
+
+
+def credential_ref(host, project):
+    """Name under which the credentials for a DataZilla project are looked
+    up when a spooled submission is uploaded."""
+    return '%s/%s' % (host, project)
+
+
+class PermanentUploadError(IOError):
+    """The server rejected a submission, so sending it again will not
+    help."""
+
+
+class DatazillaSpool(object):
+    """Queues DataZilla submissions on disk and uploads them from a
+    background thread.
+
+    Every submission is written to the spool directory before returning, so
+    the caller never waits on the network. Each test suite is sent in its
+    own request, oldest first. Failures are retried with exponential
+    backoff. Submissions the server rejects are moved to the failed
+    directory, as sending them again will not help. Submissions that fail
+    on every retry are left in the spool, and a host that can not be
+    reached is skipped so newer submissions to other hosts are still sent.
+    Anything not sent is drained the next time the spool is started.
+
+    Credentials are kept in memory only. Spooled submissions refer to them
+    by host and project, and are left in the spool until credentials for
+    them are given.
+    """
+
+    def __init__(self, path, logger, credentials=None, retries=5, backoff=2,
+                 linger=1):
+        self.path = path
+        self.failed_path = os.path.join(self.path, 'failed')
+        self.logger = logger
+        self.credentials = dict(credentials or {})
+        self.retries = retries
+        self.backoff = backoff
+        self.linger = linger
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='DatazillaSpool')
+        self._thread.daemon = True
+        self._thread.start()
+        # Drain anything left over from a previous run
+        self._wake.set()
+
+    def close(self, timeout=30):
+        """Stop the uploader after a final attempt at each pending
+        submission, without waiting for retries. Waits for at most timeout
+        seconds."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        remaining = len(self.pending())
+        if remaining:
+            self.logger.warn('%d DataZilla submissions left in %s' % (
+                remaining, self.path))
+
+    def put(self, request, suite, results, test_build, test_machine):
+        request = dict(request)
+        ref = credential_ref(request.get('host'), request.get('project'))
+        self.credentials[ref] = tuple(request.pop(field, None)
+                                      for field in CREDENTIAL_FIELDS)
+        entry = {'request': request,
+                 'credentials': ref,
+                 'suite': suite,
+                 'results': results,
+                 'test_build': test_build,
+                 'test_machine': test_machine}
+        name = '%.6f-%s.json' % (time.time(), uuid.uuid4().hex)
+        temp_path = os.path.join(self.path, '.%s' % name)
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        # Only complete entries are visible to the uploader
+        os.rename(temp_path, os.path.join(self.path, name))
+        self.logger.debug('Spooled results for %s' % suite)
+        self._wake.set()
+
+    def pending(self):
+        return sorted(os.path.join(self.path, name) for name in
+                      os.listdir(self.path) if name.endswith('.json') and
+                      not name.startswith('.'))
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            if not self._stop.is_set():
+                # Give related submissions a chance to be spooled
+                self._stop.wait(self.linger)
+            self._wake.clear()
+            self.drain()
+            if self._stop.is_set():
+                break
+
+    def drain(self):
+        """Upload pending submissions, oldest first. Hosts that can not be
+        reached are skipped for the rest of the drain."""
+        unreachable = set()
+        for entry_path in self.pending():
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+            except ValueError:
+                self.logger.error('Corrupt spool entry %s' % entry_path)
+                self._fail(entry_path)
+                continue
+            host = entry['request'].get('host')
+            credentials = self.credentials.get(entry.get('credentials'))
+            if host in unreachable or not credentials:
+                continue
+            if not self._send_with_retry(entry_path, entry, credentials):
+                unreachable.add(host)
+
+    def _send_with_retry(self, entry_path, entry, credentials):
+        """Send a submission, moving it to the failed directory if it is
+        rejected. Returns False if every attempt failed, in which case it
+        is kept for the next drain."""
+        for attempt in range(self.retries):
+            try:
+                self._send(entry, credentials)
+                os.remove(entry_path)
+                return True
+            except PermanentUploadError, e:
+                self.logger.error('DataZilla rejected %s: %s' % (
+                    entry['suite'], e))
+                self._fail(entry_path)
+                return True
+            except Exception, e:
+                if self._stop.is_set():
+                    # Keep it for the next run rather than delay exiting
+                    self.logger.warn('DataZilla upload failed (%s)' % e)
+                    return False
+                if attempt + 1 == self.retries:
+                    break
+                delay = self.backoff * 2 ** attempt
+                self.logger.warn('DataZilla upload failed (%s), retrying in '
+                                 '%d seconds' % (e, delay))
+                self._stop.wait(delay)
+        self.logger.error('DataZilla upload failed after %d attempts, '
+                          'keeping %s for the next run' % (self.retries,
+                                                           entry_path))
+        return False
+
+    def _fail(self, entry_path):
+        if not os.path.isdir(self.failed_path):
+            os.makedirs(self.failed_path)
+        os.rename(entry_path, os.path.join(self.failed_path,
+                                           os.path.basename(entry_path)))
+
+    def _send(self, entry, credentials):
+        res = dzclient.DatazillaResult()
+        res.add_testsuite(entry['suite'])
+        for metric, values in entry['results'].items():
+            res.add_test_results(entry['suite'], metric, values)
+        request = dict(entry['request'])
+        request.update(zip(CREDENTIAL_FIELDS, credentials))
+        req = dzclient.DatazillaRequest(**request)
+        req.add_datazilla_result(res)
+        for dataset in req.datasets():
+            dataset['test_build'].update(entry['test_build'])
+            dataset['test_machine'].update(entry['test_machine'])
+            self.logger.info('Submitting results to DataZilla: %s' % dataset)
+            response = req.send(dataset)
+            body = response.read()
+            if 400 <= response.status < 500:
+                raise PermanentUploadError('HTTP %d: %s' % (response.status,
+                                                            body))
+            if response.status >= 500:
+                raise IOError('HTTP %d: %s' % (response.status, body))
+            self.logger.info('Response: %s' % body)
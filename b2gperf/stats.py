@@ -0,0 +1,211 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import math
+
+import numpy
+
+# Time in milliseconds to draw a frame at 60 frames per second
+FRAME_BUDGET = 1000 / 60.0
+
+
+def normal_quantile(probability):
+    """Inverse of the standard normal cumulative distribution function."""
+    low, high = -10.0, 10.0
+    for i in range(100):
+        mid = (low + high) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < probability:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def median_confidence_interval(samples, confidence=0.95):
+    """Distribution free confidence interval for the median, taken from the
+    order statistics of the samples. Returns None if there are too few
+    samples for the requested confidence."""
+    n = len(samples)
+    z = normal_quantile(0.5 + confidence / 2)
+    lower = int(math.floor(n / 2.0 - z * math.sqrt(n) / 2))
+    upper = int(math.ceil(1 + n / 2.0 + z * math.sqrt(n) / 2))
+    if lower < 1 or upper > n:
+        return None
+    ordered = sorted(samples)
+    return ordered[lower - 1], ordered[upper - 1]
+
+
+def frame_statistics(frame_times, budget=FRAME_BUDGET):
+    """Summarizes the times in milliseconds between the frames of an
+    animation. Frames that took more than twice the budget missed at least
+    one vsync, and are counted as jank."""
+    frame_times = numpy.asarray(frame_times, dtype=float)
+    if not len(frame_times) or not frame_times.sum():
+        return {}
+    median, p95, p99 = numpy.percentile(frame_times, [50, 95, 99])
+    return {'fps': float(len(frame_times) / frame_times.sum() * 1000),
+            'frame_time_median': float(median),
+            'frame_time_p95': float(p95),
+            'frame_time_p99': float(p99),
+            'jank_count': int((frame_times > 2 * budget).sum())}
+
+
+class P2Quantile(object):
+    """Estimates a quantile in constant memory using the P-square algorithm
+    (Jain & Chlamtac, 1985).
+
+    The markers are only accurate once they have seen a reasonable number
+    of samples, so the first exact_count samples are kept and the quantile
+    is computed exactly from them. The markers are then placed at the
+    matching order statistics and updated from there on."""
+
+    exact_count = 100
+
+    def __init__(self, quantile):
+        self.quantile = quantile
+        self.buffer = []
+        self.heights = []
+        self.positions = []
+        self.desired = []
+        self.increments = [0, quantile / 2.0, quantile, (1 + quantile) / 2.0,
+                           1]
+
+    def add(self, value):
+        if self.buffer is not None:
+            self.buffer.append(value)
+            if len(self.buffer) > self.exact_count:
+                self._start_markers()
+            return
+
+        q = self.heights
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        self._adjust()
+
+    def _start_markers(self):
+        ordered = sorted(self.buffer)
+        last = len(ordered) - 1
+        self.desired = [last * increment for increment in self.increments]
+        self.positions = [int(round(d)) for d in self.desired]
+        self.heights = [ordered[n] for n in self.positions]
+        self.buffer = None
+        self._adjust()
+
+    def _adjust(self):
+        q = self.heights
+        n = self.positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+               (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / float(
+                        n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        above = (q[i + 1] - q[i]) / float(n[i + 1] - n[i])
+        below = (q[i] - q[i - 1]) / float(n[i] - n[i - 1])
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * above + (n[i + 1] - n[i] - d) * below)
+
+    @property
+    def value(self):
+        if self.buffer is not None:
+            if not self.buffer:
+                return None
+            return numpy.percentile(self.buffer, self.quantile * 100)
+        return self.heights[2]
+
+
+class RunningStats(object):
+    """Accumulates summary statistics one sample at a time.
+
+    The mean and variance use Welford's method and the median and 90th
+    percentile are estimated with P-square markers once there are enough
+    samples, so memory use does not grow with the number of samples. Raw
+    samples are only retained if keep_samples is set, in which case
+    quantiles are computed exactly.
+    """
+
+    quantiles = (0.5, 0.9)
+
+    def __init__(self, keep_samples=False):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+        self._estimators = dict((q, P2Quantile(q)) for q in self.quantiles)
+        self.samples = [] if keep_samples else None
+
+    @classmethod
+    def from_samples(cls, samples):
+        stats = cls(keep_samples=True)
+        for value in samples:
+            stats.add(value)
+        return stats
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / float(self.count)
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for estimator in self._estimators.values():
+            estimator.add(value)
+        if self.samples is not None:
+            self.samples.append(value)
+
+    @property
+    def variance(self):
+        if not self.count:
+            return None
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        if not self.count:
+            return None
+        return math.sqrt(self.variance)
+
+    def quantile(self, quantile):
+        if self.samples:
+            return numpy.percentile(self.samples, quantile * 100)
+        if quantile not in self._estimators:
+            raise ValueError('Quantile %s is not being tracked' % quantile)
+        return self._estimators[quantile].value
+
+    def median_confidence_interval(self, confidence=0.95):
+        if not self.samples:
+            return None
+        return median_confidence_interval(self.samples, confidence)
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    @property
+    def p90(self):
+        return self.quantile(0.9)
@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+class Tracer(object):
+    """Records how long each phase of a run takes.
+
+    Phases are stored as Chrome trace events, so the file written by
+    write() can be loaded into chrome://tracing. A disabled tracer records
+    nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.events.append({
+                'name': name,
+                'cat': 'b2gperf',
+                'ph': 'X',
+                'ts': int(start * 1000000),
+                'dur': int((time.time() - start) * 1000000),
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+                'args': args})
+
+    def extend(self, events):
+        self.events.extend(events)
+
+    def breakdown(self):
+        """Returns the name, count and total duration in seconds of each
+        phase, longest first."""
+        phases = {}
+        for event in self.events:
+            count, total = phases.get(event['name'], (0, 0))
+            phases[event['name']] = (count + 1, total + event['dur'])
+        return sorted(((name, count, total / 1000000.0) for
+                       name, (count, total) in phases.items()),
+                      key=lambda phase: phase[2], reverse=True)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, f)
@@ -36,12 +36,15 @@ setup(name='b2gperf',
       url='https://github.com/mozilla/b2gperf',
       license='MPL',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
-      package_data={'b2gperf': ['launchapp.js', 'scrollapp.js']},
+      package_data={'b2gperf': ['launchapp.js', 'preparedevice.js',
+                                'scrollapp.js']},
       include_package_data=True,
       zip_safe=False,
       entry_points="""
       [console_scripts]
       b2gperf = b2gperf.b2gperf:cli
+      b2gperf-archive = b2gperf.archive:cli
+      b2gperf-benchmark = b2gperf.benchmark:cli
       gaiaperf = b2gperf.mozperf:cli
       """,
       install_requires=deps,
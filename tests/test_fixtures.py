@@ -0,0 +1,87 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+import unittest
+
+from b2gperf.fixtures import ContentManifest
+from b2gperf.fixtures import parse_ls_recursive
+
+logger = logging.getLogger('test_fixtures')
+logger.addHandler(logging.NullHandler())
+
+TOOLBOX_LISTING = """/storage/sdcard:
+drwxrwxr-x root     sdcard_rw          2014-06-01 10:00 DCIM
+-rw-rw-r-- root     sdcard_rw   126020 2014-06-01 10:01 MUS_0001_1.mp3
+lrwxrwxrwx root     root              2014-06-01 10:00 link -> /data
+
+/storage/sdcard/DCIM:
+drwxrwxr-x root     sdcard_rw          2014-06-01 10:00 100MZLLA
+
+/storage/sdcard/DCIM/100MZLLA:
+-rw-rw-r-- root     sdcard_rw   363455 2014-06-01 10:02 IMG_0001_1.jpg
+-rw-rw-r-- root     sdcard_rw     4096 2014-06-01 10:02 IMG 0001 2.jpg
+"""
+
+TOYBOX_LISTING = """/sdcard:
+total 360
+-rw-rw---- 1 root sdcard_rw 363455 2014-06-01 10:02 IMG_0001_1.jpg
+"""
+
+
+class FakeDeviceManager(object):
+
+    def __init__(self, manifest=None, listing=''):
+        self.manifest = manifest
+        self.listing = listing
+
+    def fileExists(self, path):
+        return self.manifest is not None
+
+    def pullFile(self, path):
+        return json.dumps(self.manifest)
+
+    def dirExists(self, path):
+        return True
+
+    def shellCheckOutput(self, cmd):
+        if cmd[:2] == ['ls', '-ld']:
+            return 'drwxrwxr-x root sdcard_rw 2014-06-01 10:00 sdcard'
+        return self.listing
+
+
+class TestParseLsRecursive(unittest.TestCase):
+
+    def test_toolbox(self):
+        self.assertEqual(parse_ls_recursive(TOOLBOX_LISTING), set([
+            ('/storage/sdcard/MUS_0001_1.mp3', 126020),
+            ('/storage/sdcard/DCIM/100MZLLA/IMG_0001_1.jpg', 363455),
+            ('/storage/sdcard/DCIM/100MZLLA/IMG 0001 2.jpg', 4096)]))
+
+    def test_toybox(self):
+        self.assertEqual(parse_ls_recursive(TOYBOX_LISTING),
+                         set([('/sdcard/IMG_0001_1.jpg', 363455)]))
+
+
+class TestContentManifest(unittest.TestCase):
+
+    def test_truncated_file_is_missing(self):
+        dm = FakeDeviceManager(
+            manifest={'key': [['/storage/sdcard/MUS_0001_1.mp3', 200000]]},
+            listing=TOOLBOX_LISTING)
+        manifest = ContentManifest(dm, logger)
+        missing = manifest.expected('key') - manifest.list_files(
+            ['/storage/sdcard'])
+        self.assertEqual(missing,
+                         set([('/storage/sdcard/MUS_0001_1.mp3', 200000)]))
+
+    def test_manifest_without_sizes_is_ignored(self):
+        dm = FakeDeviceManager(
+            manifest={'key': ['/storage/sdcard/MUS_0001_1.mp3']})
+        self.assertEqual(ContentManifest(dm, logger).expected('key'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from b2gperf.media import duplicate_script
+from b2gperf.media import MediaPopulator
+
+logger = logging.getLogger('test_media')
+logger.addHandler(logging.NullHandler())
+
+
+class FakeB2GPopulate(object):
+
+    def __init__(self):
+        self.removed = []
+
+    def remove_media(self, file_type):
+        self.removed.append(file_type)
+
+
+class FakeDeviceManager(object):
+    """Records every call made to the device."""
+
+    deviceRoot = '/storage/sdcard'
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args))
+            return ''
+        return call
+
+
+class TestDuplicateScript(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_copies_and_removes_source(self):
+        source = os.path.join(self.path, 'IMG_0001.jpg')
+        with open(source, 'w') as f:
+            f.write('picture')
+        subprocess.check_call(['sh', '-c', duplicate_script(source, 3)])
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['IMG_0001_1.jpg', 'IMG_0001_2.jpg',
+                          'IMG_0001_3.jpg'])
+        with open(os.path.join(self.path, 'IMG_0001_3.jpg')) as f:
+            self.assertEqual(f.read(), 'picture')
+
+    def test_missing_source_fails(self):
+        source = os.path.join(self.path, 'IMG_0001.jpg')
+        self.assertNotEqual(
+            subprocess.call(['sh', '-c', duplicate_script(source, 3)]), 0)
+
+
+class TestMediaPopulator(unittest.TestCase):
+
+    def setUp(self):
+        self.b2gpopulate = FakeB2GPopulate()
+        self.dm = FakeDeviceManager()
+        self.populator = MediaPopulator(self.b2gpopulate, self.dm, logger)
+
+    def test_pictures_use_a_single_copy_command(self):
+        self.populator.populate('pictures', 700)
+        self.assertEqual(self.b2gpopulate.removed, ['picture'])
+        self.assertEqual([name for name, args in self.dm.calls],
+                         ['mkDirs', 'pushFile', 'shellCheckOutput'])
+        name, args = self.dm.calls[-1]
+        self.assertIn('-le 700', args[0][2])
+        self.assertIn('of=/storage/sdcard/DCIM/100MZLLA/IMG_0001_$i.jpg',
+                      args[0][2])
+
+    def test_videos_use_a_single_copy_command(self):
+        self.populator.populate('videos', 100)
+        self.assertEqual(self.b2gpopulate.removed, ['video'])
+        self.assertEqual(len(self.dm.calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import unittest
+
+from b2gperf.memory import find_process
+from b2gperf.memory import MemorySampler
+from b2gperf.memory import parse_b2g_info
+
+logger = logging.getLogger('test_memory')
+logger.addHandler(logging.NullHandler())
+
+B2G_INFO = """\
+                          |     megabytes     |
+           NAME  PID PPID CPU(s) NICE  USS  PSS  RSS SWAP VSIZE OOM_ADJ USER
+            b2g  165    1   31.9    0 44.8 49.0 60.6  0.0 193.4       0 root
+         (Nuwa)  293  165    1.4    0  1.1  3.2  8.8  0.0  64.3       0 root
+Communications  1034  293    3.0   18 12.3 15.6 27.1  0.0  82.0       2 u0_a34
+ Built-in Keyboa 1088  293    1.2   18  6.5  8.9 19.4  0.0  72.1      10 u0_a88
+
+System memory info:
+            Total 176.3 MB
+"""
+
+
+class FakeDeviceManager(object):
+
+    def shellCheckOutput(self, cmd):
+        return B2G_INFO
+
+
+class TestParseB2GInfo(unittest.TestCase):
+
+    def test_processes(self):
+        processes = parse_b2g_info(B2G_INFO)
+        self.assertEqual([process['name'] for process in processes],
+                         ['b2g', '(Nuwa)', 'Communications',
+                          'Built-in Keyboa'])
+        self.assertEqual(processes[2]['pid'], 1034)
+        self.assertEqual(processes[2]['uss'], 12.3)
+        self.assertEqual(processes[2]['user'], 'u0_a34')
+
+    def test_stops_at_end_of_table(self):
+        self.assertEqual(len(parse_b2g_info(B2G_INFO)), 4)
+
+    def test_no_table(self):
+        self.assertEqual(parse_b2g_info('b2g-info: not found\n'), [])
+
+    def test_find_truncated_name(self):
+        processes = parse_b2g_info(B2G_INFO)
+        self.assertEqual(find_process(processes, 'Built-in Keyboard')['pid'],
+                         1088)
+        self.assertEqual(find_process(processes, 'Settings'), None)
+
+
+class TestMemorySampler(unittest.TestCase):
+
+    def test_sample(self):
+        sampler = MemorySampler(FakeDeviceManager(), logger)
+        self.assertEqual(sampler.sample('Communications'),
+                         {'uss': 12.3, 'pss': 15.6, 'rss': 27.1})
+        self.assertEqual(sampler.sample('Settings'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import unittest
+
+from b2gperf.fake import FakeMarionette
+from b2gperf.session import MarionetteSession
+
+logger = logging.getLogger('test_session')
+logger.addHandler(logging.NullHandler())
+
+
+class TestMarionetteSession(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeMarionette()
+        self.session = MarionetteSession(self.client, logger)
+
+    def test_session_is_set_on_client(self):
+        self.session.start_session()
+        self.session.session = None
+        self.assertEqual(self.client.session, None)
+        self.assertNotIn('session', self.session.__dict__)
+
+    def test_client_changes_are_not_shadowed(self):
+        self.session.window = None
+        self.client.window = 'window'
+        self.assertEqual(self.session.window, 'window')
+
+    def test_restores_state_on_new_session(self):
+        self.session.import_script('launchapp.js')
+        self.session.start_session()
+        self.assertEqual(self.client.scripts,
+                         ['launchapp.js', 'launchapp.js'])
+
+    def test_recover_healthy_session(self):
+        self.session.start_session()
+        self.assertFalse(self.session.recover())
+
+
+if __name__ == '__main__':
+    unittest.main()
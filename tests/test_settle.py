@@ -0,0 +1,79 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import unittest
+
+from b2gperf.settle import parse_load
+from b2gperf.settle import QuiescenceMonitor
+
+logger = logging.getLogger('test_settle')
+logger.addHandler(logging.NullHandler())
+
+PROC_OUTPUT = """\
+cpu  1000 50 450 8000 500 0 0 0 0 0
+cpu0 500 25 225 4000 250 0 0 0 0 0
+intr 12345
+0.52 0.40 0.31 2/310 4021
+pgpgin 20000
+pgpgout 5000
+165 (b2g main) S 1 165 0 0 -1 4194560 100 0 0 0 300 120 0 0 20 0 40
+"""
+
+
+def load(cpu_busy, cpu_total, process_ticks=0, paged=0):
+    return {'cpu_busy': cpu_busy, 'cpu_total': cpu_total,
+            'process_ticks': process_ticks, 'paged': paged, 'loadavg': None}
+
+
+class TestParseLoad(unittest.TestCase):
+
+    def test_system(self):
+        result = parse_load(PROC_OUTPUT)
+        self.assertEqual(result['cpu_total'], 10000)
+        # Idle and iowait are not busy
+        self.assertEqual(result['cpu_busy'], 1500)
+        self.assertEqual(result['paged'], 25000)
+        self.assertEqual(result['loadavg'], 0.52)
+        self.assertEqual(result['process_ticks'], 0)
+
+    def test_process(self):
+        # The command name contains a space
+        self.assertEqual(parse_load(PROC_OUTPUT, 165)['process_ticks'], 420)
+
+    def test_other_process(self):
+        self.assertEqual(parse_load(PROC_OUTPUT, 16)['process_ticks'], 0)
+
+    def test_empty(self):
+        self.assertEqual(parse_load(''), load(0, 0))
+
+
+class TestIsQuiet(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = QuiescenceMonitor(None, logger)
+
+    def test_quiet(self):
+        self.assertTrue(self.monitor.is_quiet(
+            (0, load(100, 1000)), (1, load(150, 2000, paged=50))))
+
+    def test_busy_cpu(self):
+        self.assertFalse(self.monitor.is_quiet(
+            (0, load(100, 1000)), (1, load(400, 2000))))
+
+    def test_busy_process(self):
+        self.assertFalse(self.monitor.is_quiet(
+            (0, load(100, 1000)), (1, load(150, 2000, process_ticks=80))))
+
+    def test_paging(self):
+        self.assertFalse(self.monitor.is_quiet(
+            (0, load(100, 1000)), (1, load(150, 2000, paged=500))))
+
+    def test_no_ticks(self):
+        self.assertFalse(self.monitor.is_quiet(
+            (0, load(100, 1000)), (1, load(100, 1000))))
+
+
+if __name__ == '__main__':
+    unittest.main()
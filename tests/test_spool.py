@@ -0,0 +1,144 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from b2gperf.fake import FakeDatazillaServer
+from b2gperf.spool import DatazillaSpool
+
+logger = logging.getLogger('test_spool')
+logger.addHandler(logging.NullHandler())
+
+
+def unused_host():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    host = '%s:%d' % s.getsockname()
+    s.close()
+    return host
+
+
+def request(host, project='b2gperf'):
+    return {'protocol': 'http',
+            'host': host,
+            'project': project,
+            'oauth_key': 'key',
+            'oauth_secret': 'secret',
+            'machine_name': 'test',
+            'branch': 'master'}
+
+
+class TestDatazillaSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = FakeDatazillaServer()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.path)
+
+    def spool(self, **kwargs):
+        kwargs.setdefault('retries', 2)
+        kwargs.setdefault('backoff', 0)
+        return DatazillaSpool(self.path, logger, **kwargs)
+
+    def put(self, spool, host, suite='contacts'):
+        spool.put(request(host), suite, {'cold_load_time': [1000, 1100]},
+                  {'gaia_revision': 'abc'}, {'type': 'test'})
+
+    def failed(self):
+        failed_path = os.path.join(self.path, 'failed')
+        if not os.path.isdir(failed_path):
+            return []
+        return os.listdir(failed_path)
+
+    def test_drain_uploads_and_removes_entries(self):
+        spool = self.spool()
+        self.put(spool, self.server.host)
+        spool.drain()
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(self.failed(), [])
+
+    def test_credentials_are_not_written(self):
+        spool = self.spool()
+        self.put(spool, self.server.host)
+        with open(spool.pending()[0]) as f:
+            entry = f.read()
+        self.assertNotIn('secret', entry)
+        self.assertEqual(json.loads(entry)['credentials'],
+                         '%s/b2gperf' % self.server.host)
+
+    def test_unknown_credentials_are_left_pending(self):
+        self.put(self.spool(), self.server.host)
+        # A new spool has not been given the credentials of the entry
+        spool = self.spool()
+        spool.drain()
+        self.assertEqual(self.server.received, [])
+        self.assertEqual(len(spool.pending()), 1)
+
+    def test_rejected_entry_is_not_retried(self):
+        self.server.status = 401
+        spool = self.spool(retries=5)
+        self.put(spool, self.server.host)
+        spool.drain()
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(len(self.failed()), 1)
+
+    def test_failing_entry_does_not_block_newer_entries(self):
+        spool = self.spool()
+        self.put(spool, unused_host(), suite='old')
+        self.put(spool, self.server.host, suite='new')
+        spool.drain()
+        self.assertEqual(len(self.server.received), 1)
+        # The unreachable entry is kept to be drained on the next run
+        self.assertEqual(len(spool.pending()), 1)
+        self.assertEqual(self.failed(), [])
+
+    def test_server_error_is_kept_for_next_drain(self):
+        self.server.status = 503
+        spool = self.spool()
+        self.put(spool, self.server.host)
+        spool.drain()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(len(spool.pending()), 1)
+        self.assertEqual(self.failed(), [])
+        self.server.status = 200
+        spool.drain()
+        self.assertEqual(spool.pending(), [])
+
+    def test_rejected_entry_does_not_block_newer_entries(self):
+        spool = self.spool()
+        self.put(spool, self.server.host, suite='old')
+        self.server.status = 400
+        spool.drain()
+        self.server.status = 200
+        self.put(spool, self.server.host, suite='new')
+        spool.drain()
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(len(self.failed()), 1)
+
+    def test_close_keeps_failures_without_waiting(self):
+        spool = self.spool(retries=5, backoff=60, linger=0)
+        spool.start()
+        self.put(spool, unused_host())
+        start = time.time()
+        spool.close()
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(len(spool.pending()), 1)
+        self.assertEqual(self.failed(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+import numpy
+
+from b2gperf.stats import P2Quantile
+from b2gperf.stats import RunningStats
+
+
+def lognormal(count, seed=1):
+    return list(numpy.random.RandomState(seed).lognormal(7, 0.3, count))
+
+
+class TestP2Quantile(unittest.TestCase):
+
+    def estimate(self, quantile, samples):
+        estimator = P2Quantile(quantile)
+        for value in samples:
+            estimator.add(value)
+        return estimator.value
+
+    def test_empty(self):
+        self.assertEqual(P2Quantile(0.9).value, None)
+
+    def test_small_samples_are_exact(self):
+        for count in (1, 5, 6, 8, 10, 30, P2Quantile.exact_count):
+            samples = lognormal(count)
+            for quantile in (0.5, 0.9):
+                self.assertAlmostEqual(
+                    self.estimate(quantile, samples),
+                    numpy.percentile(samples, quantile * 100))
+
+    def test_large_samples_are_estimated(self):
+        samples = lognormal(5000)
+        for quantile in (0.5, 0.9):
+            expected = numpy.percentile(samples, quantile * 100)
+            self.assertLess(
+                abs(self.estimate(quantile, samples) - expected) / expected,
+                0.02)
+
+
+class TestRunningStats(unittest.TestCase):
+
+    def test_quantiles_without_samples(self):
+        samples = lognormal(10)
+        stats = RunningStats()
+        for value in samples:
+            stats.add(value)
+        self.assertEqual(stats.samples, None)
+        self.assertAlmostEqual(stats.median, numpy.median(samples))
+        self.assertAlmostEqual(stats.p90, numpy.percentile(samples, 90))
+        self.assertAlmostEqual(stats.mean, numpy.mean(samples))
+        self.assertAlmostEqual(stats.std, numpy.std(samples))
+
+
+if __name__ == '__main__':
+    unittest.main()